@@ -8,14 +8,20 @@ import com.intellij.ide.impl.ProjectUtil;
 import com.intellij.openapi.application.ApplicationStarter;
 import com.intellij.openapi.application.WriteAction;
 import com.intellij.openapi.diagnostic.Logger;
+import com.intellij.openapi.project.Project;
 import com.intellij.openapi.projectRoots.impl.ProjectJdkTableImpl;
 import com.intellij.openapi.roots.ProjectRootManager;
 import org.jetbrains.annotations.NotNull;
 
-import java.io.BufferedWriter;
 import java.io.File;
-import java.io.FileWriter;
 import java.io.IOException;
+import java.nio.ByteBuffer;
+import java.nio.channels.FileChannel;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.nio.file.StandardOpenOption;
 import java.util.Arrays;
 import java.util.List;
 
@@ -36,12 +42,24 @@ public class PluginRunner implements ApplicationStarter {
             System.exit(0);
         }
 
-        var path = args.get(1);
+        try {
+            analyzeProject(args.get(1), args.get(2), args.get(3));
+        } catch (IllegalStateException e) {
+            System.out.println(e.getMessage());
+        }
+        System.exit(0);
+    }
+
+    /**
+     * Analyzes a single project and writes the results to {@code <outputDir>/<projectName>.json}.
+     * The opened project is returned so that callers which keep the IDE alive can close it.
+     *
+     * @throws IllegalStateException when the project or the Python interpreter is not available
+     */
+    public static Project analyzeProject(String path, String pythonInterpreter, String outputDir) {
         if (path.charAt(path.length() - 1) == File.separatorChar) {
             path = path.substring(0, path.length() - 1);
         }
-        var pythonInterpreter = args.get(2);
-        var outputDir = args.get(3);
         if (outputDir.charAt(outputDir.length() - 1) == File.separatorChar) {
             outputDir = outputDir.substring(0, outputDir.length() - 1);
         }
@@ -56,8 +74,7 @@ public class PluginRunner implements ApplicationStarter {
         var p = ProjectUtil.openOrImport(path, null, true);
 
         if (p == null) {
-            System.out.println("project is null");
-            System.exit(0);
+            throw new IllegalStateException("project is null");
         }
         var projectRootManager = ProjectRootManager.getInstance(p);
         if (projectRootManager.getProjectSdk() == null) {
@@ -68,8 +85,8 @@ public class PluginRunner implements ApplicationStarter {
                 Arrays.stream(ProjectJdkTableImpl.getInstance().getAllJdks()).forEach(pythonCandidate ->
                         System.out.println("pythonCandidate = " + pythonCandidate)
                 );
-                System.out.println("If nothing printed, you may have to go to GUI mode to configure a Python interpreter");
-                System.exit(0);
+                ProjectUtil.closeAndDispose(p);
+                throw new IllegalStateException("If nothing printed, you may have to go to GUI mode to configure a Python interpreter");
             }
             WriteAction.run(() -> projectRootManager.setProjectSdk(pythonSdk));
         }
@@ -106,15 +123,24 @@ public class PluginRunner implements ApplicationStarter {
                     .setPrettyPrinting()
                     .create()
                     .toJson(JsonParser.parseString(fileResultArray.toString()));
+            // write to a temporary file first so that an interrupted run never leaves a truncated result
+            var outputPath = Paths.get(outputFileName);
+            var tmpPath = Paths.get(outputFileName + ".tmp");
             try {
-                var bufferedWriter = new BufferedWriter(new FileWriter(outputFileName));
-                bufferedWriter.write(jsonString);
-                bufferedWriter.close();
+                try (var channel = FileChannel.open(tmpPath, StandardOpenOption.CREATE,
+                        StandardOpenOption.TRUNCATE_EXISTING, StandardOpenOption.WRITE)) {
+                    var buffer = ByteBuffer.wrap(jsonString.getBytes(StandardCharsets.UTF_8));
+                    while (buffer.hasRemaining()) {
+                        channel.write(buffer);
+                    }
+                    channel.force(true);
+                }
+                Files.move(tmpPath, outputPath, StandardCopyOption.ATOMIC_MOVE, StandardCopyOption.REPLACE_EXISTING);
             } catch (IOException e) {
                 e.printStackTrace();
             }
             System.out.println("done");
         }
-        System.exit(0);
+        return p;
     }
 }
@@ -0,0 +1,102 @@
+package pynose;
+
+import com.intellij.ide.impl.ProjectUtil;
+import com.intellij.openapi.application.ApplicationStarter;
+import com.intellij.openapi.diagnostic.Logger;
+import com.intellij.openapi.vfs.LocalFileSystem;
+import com.intellij.openapi.vfs.VfsUtil;
+import org.jetbrains.annotations.NotNull;
+
+import java.io.BufferedReader;
+import java.io.BufferedWriter;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStreamWriter;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.nio.charset.StandardCharsets;
+import java.util.List;
+
+/**
+ * Keeps the headless IDE resident and analyzes projects requested over a local socket,
+ * so that the JVM and PyCharm start-up is paid once instead of once per project.
+ * <p>
+ * Protocol (one request per line, UTF-8):
+ * <pre>
+ *   request:  projectPath \t outputDir
+ *   response: ok | error \t message
+ *   request:  quit
+ * </pre>
+ */
+public class PluginServer implements ApplicationStarter {
+    private static final Logger LOG = Logger.getInstance(PluginServer.class);
+
+    @Override
+    public String getCommandName() {
+        return "pynose-server";
+    }
+
+    @Override
+    public void main(@NotNull List<String> args) {
+        System.out.println("args = " + args);
+        if (args.size() != 3 || args.subList(1, args.size()).stream().anyMatch(String::isBlank)) {
+            System.err.println("incorrect command line arguments");
+            System.err.println("usage: pynose-server pythonInterpreter port");
+            System.exit(0);
+        }
+
+        var pythonInterpreter = args.get(1);
+        var port = Integer.parseInt(args.get(2));
+        try (var serverSocket = new ServerSocket(port, 1, InetAddress.getLoopbackAddress())) {
+            System.out.println("listening on port " + port);
+            while (true) {
+                try (var socket = serverSocket.accept();
+                     var reader = new BufferedReader(new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+                     var writer = new BufferedWriter(new OutputStreamWriter(socket.getOutputStream(), StandardCharsets.UTF_8))) {
+                    String line;
+                    while ((line = reader.readLine()) != null) {
+                        if (line.equals("quit")) {
+                            System.exit(0);
+                        }
+                        writer.write(handle(line, pythonInterpreter));
+                        writer.newLine();
+                        writer.flush();
+                    }
+                } catch (IOException e) {
+                    LOG.warn(Util.exceptionToString(e));
+                }
+            }
+        } catch (IOException e) {
+            e.printStackTrace();
+        }
+        System.exit(0);
+    }
+
+    private static String handle(String line, String pythonInterpreter) {
+        var fields = line.split("\t");
+        if (fields.length != 2) {
+            return "error\tincorrect request: " + line;
+        }
+
+        var path = fields[0];
+        var outputDir = fields[1];
+        // the working tree is rewritten between requests, so the VFS snapshot must be refreshed
+        var root = LocalFileSystem.getInstance().refreshAndFindFileByIoFile(new File(path));
+        if (root == null) {
+            return "error\tproject not found: " + path;
+        }
+        VfsUtil.markDirtyAndRefresh(false, true, true, root);
+
+        try {
+            var project = PluginRunner.analyzeProject(path, pythonInterpreter, outputDir);
+            ProjectUtil.closeAndDispose(project);
+        } catch (IllegalStateException e) {
+            return "error\t" + e.getMessage();
+        } catch (RuntimeException e) {
+            LOG.warn(Util.exceptionToString(e));
+            return "error\t" + e;
+        }
+        return "ok";
+    }
+}
@@ -0,0 +1,185 @@
+"""
+結果のファイルを中断されても壊れないように書き出す python API を提供するモジュール．
+一時ファイルに書いてから os.replace で置き換えるので，途中で止まっても
+出力先には書き終えたファイルしか現れない．各ステージの再開の判定は出力先の存在で行うので，
+破損したファイルを解析済みとみなすことがなくなる．
+"""
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+from global_var import atomic_fsync
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = 'w', encoding: str = None,
+                 fsync: Optional[bool] = None) -> Iterator[IO]:
+    """
+    path へ原子的に書き出すファイルを開く．
+    with を抜けたときに書き終えたものとして置き換え，例外が起きた場合は何も残さない．
+    :param path: 出力先．
+    :param mode: 'w' もしくは 'wb'．
+    :param encoding: テキストモードの文字コード．
+    :param fsync: True ならば置き換える前にディスクに書き込み，置き換えも確定させる．
+    None ならば atomic_fsync が 'each' のときだけ行う．
+    """
+    if fsync is None:
+        fsync = atomic_fsync == 'each'
+    fd, tmp_path = make_temp_file(path)
+    try:
+        with open(fd, mode, encoding=encoding) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    if fsync:
+        fsync_dir(path.parent)
+
+
+class AtomicWriter:
+    """
+    複数のファイルを原子的に書き出し，まとめて確定させるクラス．
+    fsync が 'batch' ならば一時ファイルの fsync を commit まで遅らせ，まとめて並行に行う．
+    ファイルシステムが複数の fsync を 1 度のジャーナルの書き込みにまとめられるので，
+    小さなファイルを大量に書き出す場合に速い．ディレクトリの fsync はディレクトリごとに 1 度だけ行う．
+    システム全体を書き込む os.sync は使わない．
+    commit するまで出力先には何も現れない．
+    """
+    # commit で並行に fsync する一時ファイルの数の上限
+    max_fsync_workers = 16
+
+    def __init__(self, fsync: Optional[str] = None):
+        """
+        :param fsync: 'each' ならば一時ファイルを閉じる前にそれぞれ，'batch' ならば commit でまとめて
+        ディスクに書き込み，置き換えも確定させる．'none' ならば行わない．None ならば atomic_fsync に従う．
+        """
+        self.fsync = atomic_fsync if fsync is None else fsync
+        if self.fsync not in ('each', 'batch', 'none'):
+            raise ValueError(f'unknown fsync mode: {self.fsync}')
+        self._pending: list[tuple[str, Path]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    @contextmanager
+    def open(self, path: Path, mode: str = 'w',
+             encoding: str = None) -> Iterator[IO]:
+        """
+        出力先と同じディレクトリに一時ファイルを作って開く．
+        :param path: 出力先．
+        :param mode: 'w' もしくは 'wb'．
+        :param encoding: テキストモードの文字コード．
+        """
+        fd, tmp_path = make_temp_file(path)
+        try:
+            with open(fd, mode, encoding=encoding) as f:
+                yield f
+                if self.fsync == 'each':
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._pending.append((tmp_path, path))
+
+    def commit(self) -> None:
+        """
+        書き終えたファイルを出力先に置き換える．
+        """
+        if not self._pending:
+            return
+        if self.fsync == 'batch':
+            tmp_paths = [tmp_path for tmp_path, _ in self._pending]
+            workers = min(self.max_fsync_workers, len(tmp_paths))
+            with ThreadPoolExecutor(workers) as executor:
+                # 例外があれば置き換える前に投げる
+                list(executor.map(fsync_file, tmp_paths))
+        directories = set()
+        for tmp_path, path in self._pending:
+            os.replace(tmp_path, path)
+            directories.add(path.parent)
+        self._pending.clear()
+        if self.fsync != 'none':
+            for directory in directories:
+                fsync_dir(directory)
+
+    def discard(self) -> None:
+        """
+        まだ置き換えていない一時ファイルを削除する．
+        """
+        for tmp_path, _ in self._pending:
+            os.unlink(tmp_path)
+        self._pending.clear()
+
+
+def open_atomic(path: Path, mode: str = 'w', encoding: str = None,
+                writer: Optional[AtomicWriter] = None):
+    """
+    writer が与えられればそれで，なければ atomic_write で path を開く．
+    """
+    if writer is None:
+        return atomic_write(path, mode, encoding)
+    return writer.open(path, mode, encoding)
+
+
+def make_temp_file(path: Path) -> tuple[int, str]:
+    """
+    出力先と同じディレクトリに一時ファイルを作る．末尾が .tmp なので *.json の列挙には拾われない．
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', suffix='.tmp',
+                                    dir=path.parent)
+    # mkstemp は所有者だけが読み書きできるファイルを作るので，通常のファイルと同じ権限に戻す
+    os.chmod(tmp_path, 0o666 & ~current_umask())
+    return fd, tmp_path
+
+
+@lru_cache(maxsize=1)
+def current_umask() -> int:
+    """
+    プロセスの umask を返す．umask は設定しなければ読めないので，初めて使うときに 1 度だけ読む．
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def fsync_file(path: str) -> None:
+    """
+    書き終えて閉じたファイルをディスクに書き込む．
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(directory: Path) -> None:
+    """
+    ディレクトリのエントリの変更を確定させる．対応していない環境では何もしない．
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,126 @@
+"""
+mapping_test_to_prod.py の scan_imports と get_imports の速さと結果を比べるプログラム．
+解析対象のリポジトリの全コミットに含まれるテストファイルを，中身が同じものは 1 度だけ読み込んで比べる．
+"""
+import sys
+import time
+from pathlib import Path, PurePosixPath
+
+from tqdm import tqdm
+
+from global_var import deadline
+from mapping_test_to_prod import get_imports, import_unittest, scan_imports
+from repo import Repo
+
+
+def main():
+    """
+    リポジトリごとにテストファイルを集め，2 つの抽出方法の時間と結果の違いを表示する．
+    """
+    sys.setrecursionlimit(10000)  # ast 解析中の再帰制限対策
+
+    start = input('start:').zfill(4)
+    end = input('end:').zfill(4)
+
+    repo_prefixes = Path('../repo').resolve(strict=True).glob('*')
+    target_list = [repo_prefix.glob('*').__next__()
+                   for repo_prefix in repo_prefixes
+                   if start <= repo_prefix.name[1:5] <= end]
+    target_list.sort()
+
+    contents_list = []
+    for target in tqdm(target_list):
+        contents_list.extend(read_test_files(Repo(target)))
+
+    ast_time, ast_results = measure(parse_with_ast, contents_list)
+    scan_time, scan_results = measure(scan_imports, contents_list)
+    read_time, read_results = measure(read_with_scanner, contents_list)
+
+    fallback_cnt = sum(1 for result in scan_results if result is None)
+    # 構文の正しいファイルで，抜き出したインポートが違うもの
+    mismatch_cnt = sum(1 for ast_result, scan_result
+                       in zip(ast_results, scan_results)
+                       if ast_result is not None and scan_result is not None
+                       and ast_result != scan_result)
+    # 対応付けの対象となるか (unittest をインポートしているか) が違うもの
+    decision_mismatch_cnt = sum(1 for ast_result, read_result
+                                in zip(ast_results, read_results)
+                                if to_decision(ast_result)
+                                != to_decision(read_result))
+
+    print(f'files: {len(contents_list)}')
+    print(f'get_imports: {ast_time:.3f} s')
+    print(f'scan_imports: {scan_time:.3f} s '
+          f'(fallback: {fallback_cnt}, mismatch: {mismatch_cnt})')
+    print(f'scan_imports + get_imports: {read_time:.3f} s '
+          f'(decision mismatch: {decision_mismatch_cnt})')
+    if read_time > 0:
+        print(f'speedup: {ast_time / read_time:.2f}x')
+
+
+def read_test_files(repo: Repo) -> list[str]:
+    """
+    全コミットに含まれるテストファイルの中身を，blob の重複を除いて読み込む．
+    """
+    object_ids = set()
+    for commit_hash in tqdm(repo.get_commit_hashes(until=deadline),
+                            leave=False):
+        for entry in repo.list_tree(commit_hash):
+            if entry.path.endswith('.py') \
+                    and 'test' in PurePosixPath(entry.path).stem:
+                object_ids.add(entry.object_id)
+
+    contents_list = []
+    for object_id in sorted(object_ids):
+        try:
+            contents = repo.object_reader.read_text(object_id)
+        except UnicodeDecodeError:
+            continue
+        if contents is not None:
+            contents_list.append(contents)
+    return contents_list
+
+
+def measure(function, contents_list: list[str]) -> tuple[float, list]:
+    """
+    すべてのファイルに function を適用するのにかかった時間と結果を返す．
+    """
+    results = []
+    start_time = time.perf_counter()
+    for contents in contents_list:
+        results.append(function(contents))
+    return time.perf_counter() - start_time, results
+
+
+def parse_with_ast(contents: str):
+    """
+    get_imports で抜き出す．解析できなかった場合は None．
+    """
+    try:
+        return get_imports(contents)
+    except (SyntaxError, ValueError):
+        return None
+
+
+def read_with_scanner(contents: str):
+    """
+    mapping_test_to_prod.read_imports と同じく，scan_imports で判断できないファイルと
+    unittest をインポートしているファイルだけを get_imports で抜き出す．
+    """
+    modules = scan_imports(contents)
+    if modules is None or import_unittest(modules):
+        return parse_with_ast(contents)
+    return modules
+
+
+def to_decision(modules):
+    """
+    対応付けの対象となる場合はインポートの一覧を，ならない場合は None を返す．
+    """
+    if modules is None or not import_unittest(modules):
+        return None
+    return modules
+
+
+if __name__ == '__main__':
+    main()
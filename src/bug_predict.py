@@ -4,7 +4,6 @@
 テストコードの 20 種類のメトリクスの順で予測を行う．
 """
 
-import json
 from matplotlib import pyplot as plt
 import numpy as np
 from pathlib import Path
@@ -12,6 +11,8 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import roc_curve, auc
 from sklearn.model_selection import StratifiedKFold
 
+import json_io
+
 
 def shuffle_data(X, y, seed=42): # noqa
     """
@@ -30,8 +31,8 @@ def main():
     テストコードの 20 種類のメトリクスの順で予測を行う．
     ROC を適応して， AUC を算出し，10 分割の交差検証を実施する．
     """
-    with Path(f'../result/data_forge/aggregated.json').open() as f:
-        data_for_prediction = json.load(f)
+    data_for_prediction \
+        = json_io.read(Path('../result/data_forge/aggregated.json'))
     predict_using_test_smell(data_for_prediction)
     predict_using_prod_metrics(data_for_prediction)
     predict_using_test_metrics(data_for_prediction)
@@ -2,17 +2,18 @@
 テストスメルの出現割合や，バグとの関係性を分析する．
 """
 import copy
-import json
 from pathlib import Path
 
+import json_io
+
 
 def main():
     """
     統合されたデータからテストスメルやバグのデータを取得して
     表形式に情報を出力する．
     """
-    with Path(f'../result/data_forge/aggregated.json').open() as f:
-        forged_data: dict = json.load(f)
+    forged_data: dict \
+        = json_io.read(Path('../result/data_forge/aggregated.json'))
 
     bug_list = get_bug_data(forged_data)
     smells_list = get_smell_data(forged_data)
@@ -1,10 +1,15 @@
 """
 Ctrl + c などによってたまに PyNose の出力する json ファイルが破損することがある．
-それらを検出し，削除するプログラム．
-具体的には，ファイルの読み込みに失敗するか，解析に失敗した場合に削除する．
+それらを検出し，隔離するプログラム．
+具体的には，末尾が途切れているか，ファイルの読み込みに失敗するか，解析に失敗した場合に
+../result/clean_corrupted_pynose_json/quarantine に移動し，report.tsv に理由を記録する．
+問題のなかったファイルはマニフェストに記録し，次回からは新しいファイルだけを調べる．
 """
-import sys
+import os
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                as_completed, wait)
 from pathlib import Path
+from typing import Iterator, Optional
 
 from tqdm import tqdm
 
@@ -13,20 +18,167 @@ from pynose_result_manager import PyNoseResultManager
 
 def main():
     """
-    読み込みと加工ができないファイルを削除する．
+    読み込みと加工ができないファイルを隔離する．
+    入力は列挙しながらバッチにまとめて投入し，同時に処理中のバッチの数を抑える．
     """
-    result_root = Path('../result/execute_pynose_per_commit').resolve()
-    file_paths = result_root.rglob('*.json')
-    file_cnt = sum(1 for _ in result_root.rglob('*.json'))
+    max_workers = os.cpu_count()
+    max_in_flight = max_workers * 2
 
-    for file_path in tqdm(file_paths, total=file_cnt):
-        try:
-            pynose_result_manager = PyNoseResultManager(file_path)
-            pynose_result_manager.count_test_smells_per_file()
-        except KeyboardInterrupt:
-            sys.exit(0)
-        except: # noqa
-            file_path.unlink()
+    with ProcessPoolExecutor(max_workers) as executor, tqdm() as pbar:
+        in_flight = {}
+        for repo_name, batch in iter_batches(batch_size=100):
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pbar.update(record_checked(in_flight.pop(future),
+                                               *future.result()))
+            in_flight[executor.submit(check_batch, batch)] = repo_name
+        for future in as_completed(in_flight):
+            pbar.update(record_checked(in_flight[future], *future.result()))
+
+
+def result_root() -> Path:
+    """
+    このプログラムの結果を格納するディレクトリを返す．
+    """
+    this_file_name = Path(__file__).stem
+    return Path('../result/').resolve() / this_file_name
+
+
+def iter_batches(batch_size: int) -> Iterator[tuple[str, list[Path]]]:
+    """
+    os.scandir でリポジトリのディレクトリを 1 つずつ読みながら，
+    マニフェストに載っていないファイルを batch_size 個ずつまとめて返す．
+    :param batch_size: 1 つのバッチに含めるファイルの数．
+    :return: リポジトリ名とファイルパスのリストの組．
+    """
+    pynose_root = Path('../result/execute_pynose_per_commit').resolve()
+    with os.scandir(pynose_root) as repo_entries:
+        for repo_entry in repo_entries:
+            if not repo_entry.is_dir():
+                continue
+            repo_name = repo_entry.name
+            checked = load_manifest(repo_name)
+            batch = []
+            with os.scandir(repo_entry.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json') \
+                            and 'error' not in entry.name \
+                            and entry.name not in checked:
+                        batch.append(Path(entry.path))
+                    if len(batch) == batch_size:
+                        yield repo_name, batch
+                        batch = []
+            if batch:
+                yield repo_name, batch
+
+
+def manifest_path(repo_name: str) -> Path:
+    """
+    問題のなかったファイル名を記録するマニフェストのパスを返す．
+    """
+    return result_root() / f'{repo_name}.manifest'
+
+
+def load_manifest(repo_name: str) -> set:
+    """
+    問題のなかったファイル名を読み込む．
+    :param repo_name: リポジトリ名．
+    """
+    path = manifest_path(repo_name)
+    if not path.exists():
+        return set()
+    with path.open() as f:
+        return {line.rstrip('\n') for line in f if line.endswith('\n')}
+
+
+def record_checked(repo_name: str, valid_names: list,
+                   corrupted: list) -> int:
+    """
+    問題のなかったファイル名をマニフェストに追記し，破損したファイルを隔離する．
+    :param repo_name: リポジトリ名．
+    :param valid_names: 問題のなかったファイル名．
+    :param corrupted: 破損したファイルのパスと理由の組．
+    :return: 調べたファイルの数．
+    """
+    root = result_root()
+    root.mkdir(parents=True, exist_ok=True)
+    with manifest_path(repo_name).open('a') as f:
+        f.writelines(f'{name}\n' for name in valid_names)
+
+    if corrupted:
+        quarantine_dir = root / 'quarantine' / repo_name
+        quarantine_dir.mkdir(parents=True, exist_ok=True)
+        with (root / 'report.tsv').open('a') as report:
+            for file_path, reason in corrupted:
+                try:
+                    os.replace(file_path, quarantine_dir / file_path.name)
+                except OSError as e:  # 調べている間に消えたファイルなど
+                    reason = f'{reason} (not moved: {format_reason(e)})'
+                report.write(f'{repo_name}\t{file_path.name}\t{reason}\n')
+    return len(valid_names) + len(corrupted)
+
+
+def check_batch(file_paths: list[Path]) -> tuple[list, list]:
+    """
+    ワーカープロセスで複数のファイルをまとめて調べる．
+    :param file_paths: 調べるファイルのパス．
+    :return: 問題のなかったファイル名と，破損したファイルのパスと理由の組．
+    """
+    valid_names = []
+    corrupted = []
+    for file_path in file_paths:
+        reason = check(file_path)
+        if reason is None:
+            valid_names.append(file_path.name)
+        else:
+            corrupted.append((file_path, reason))
+    return valid_names, corrupted
+
+
+def check(file_path: Path) -> Optional[str]:
+    """
+    ファイルが破損していないか調べる．
+    中断されたファイルは末尾が途切れているので，先頭と末尾の数バイトで先に判定し，
+    それを通ったものだけを逐次読み込みで最後まで解析する．
+    :return: 破損している理由．問題がなければ None．
+    """
+    try:
+        reason = check_brackets(file_path)
+        if reason is not None:
+            return reason
+        PyNoseResultManager(file_path, streaming=True) \
+            .count_test_smells_per_file()
+    # 読み込めないファイル (OSError) も解析の失敗と同じく理由として報告する
+    except Exception as e:  # noqa
+        return format_reason(e)
+    return None
+
+
+def format_reason(e: Exception) -> str:
+    """
+    例外を report.tsv の 1 列に収まる理由にする．
+    """
+    return f'{type(e).__name__}: {e}'.replace('\t', ' ').replace('\n', ' ')
+
+
+def check_brackets(file_path: Path, tail_size: int = 64) -> Optional[str]:
+    """
+    PyNose の結果は配列なので，空白を除いた先頭が [ で末尾が ] であるかを調べる．
+    :param file_path: 調べるファイルのパス．
+    :param tail_size: 末尾から読み込むバイト数．
+    :return: 破損している理由．問題がなければ None．
+    """
+    with file_path.open('rb') as f:
+        head = f.read(tail_size).lstrip()
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - tail_size))
+        tail = f.read().rstrip()
+    if not head:
+        return 'empty'
+    if not head.startswith(b'[') or not tail.endswith(b']'):
+        return 'truncated'
+    return None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,361 @@
+"""
+1 回の git log でコミットの情報を集め，リポジトリごとに保存するモジュール．
+"""
+import sqlite3
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+RECORD_SEP = b'\x1e'
+FIELD_SEP = '\x1f'
+LOG_FORMAT = '--format=%x1e%H%x1f%P%x1f%at%x1f%ct%x1f%B%x1f'
+
+
+class CommitIndex:
+    """
+    コミットハッシュ，順番，親，author date，コミットメッセージ，変更のあったファイルを
+    .git 内の SQLite に保存し，各ステージから O(1) で引けるようにするクラス．
+    新しいコミットが増えていた場合は差分だけを追記する．
+    """
+    file_name = 'commit_index.sqlite3'
+
+    def __init__(self, repo_path: Path, git_dir: Path, branch_name: str):
+        """
+        :param repo_path: リポジトリへのパス．
+        :param git_dir: .git ディレクトリへのパス．インデックスはここに保存する．
+        :param branch_name: 対象のブランチ名．
+        """
+        self.repo_path = repo_path
+        self.branch_name = branch_name
+        self._conn = sqlite3.connect(git_dir / self.file_name)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS commits ('
+                           'ordinal INTEGER PRIMARY KEY, '
+                           'hash TEXT NOT NULL UNIQUE, '
+                           'parents TEXT NOT NULL, '
+                           'author_date INTEGER NOT NULL, '
+                           'committer_date INTEGER NOT NULL, '
+                           'message TEXT NOT NULL, '
+                           'changed_paths TEXT NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta ('
+                           'key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.update()
+        self._load()
+
+    def update(self) -> None:
+        """
+        ブランチの先頭が前回から変わっていればインデックスを更新する．
+        git rev-list で全コミットの順番を求め，インデックスの順番がその先頭と一致していれば
+        新しいコミットの情報だけを追記し，そうでなければ作り直す．
+        マージで古い日付のコミットが取り込まれると既存の順番が変わるため，単純には追記できない．
+        """
+        tip = get_tip(self.repo_path, self.branch_name)
+        indexed_tip = self._get_meta('tip')
+        if tip == indexed_tip:
+            return
+
+        order = list_commits(self.repo_path, tip)
+        indexed = [row[0] for row in self._conn.execute(
+            'SELECT hash FROM commits ORDER BY ordinal')]
+        if indexed_tip and indexed == order[:len(indexed)] \
+                and is_ancestor(self.repo_path, indexed_tip, tip):
+            revision_range = f'{indexed_tip}..{tip}'
+            new_hashes = order[len(indexed):]
+        else:
+            revision_range = tip
+            new_hashes = order
+            indexed = []
+            self._conn.execute('DELETE FROM commits')
+
+        records = {}
+        for record in self._iter_log(revision_range):
+            if record[0] in records:
+                # -m を付けるとマージコミットは親ごとに出力される．
+                records[record[0]][5].extend(record[5])
+                continue
+            records[record[0]] = list(record)
+
+        rows = [(ordinal, *records[commit_hash][:5],
+                 '\0'.join(records[commit_hash][5]))
+                for ordinal, commit_hash
+                in enumerate(new_hashes, start=len(indexed) + 1)]
+        self._conn.executemany(
+            'INSERT INTO commits VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        self._set_meta('tip', tip)
+        self._conn.commit()
+
+    def get_commit_hashes(self, until: Optional[datetime] = None) -> list:
+        """
+        古い順にコミットハッシュを返す．
+
+        :param until: どの時点までのコミットハッシュを取得するか．デフォルトは最新まで．
+        :return: コミットハッシュのリスト．
+        """
+        if until is None:
+            return list(self._hashes)
+        if until not in self._hashes_until:
+            timestamp = until.timestamp()
+            self._hashes_until[until] = [
+                commit_hash for commit_hash, committer_date
+                in zip(self._hashes, self._committer_dates)
+                if committer_date <= timestamp]
+        return list(self._hashes_until[until])
+
+    def get_commit_messages(self, until: Optional[datetime] = None) -> list:
+        """
+        古い順にコミットメッセージを返す．
+
+        :param until: どの時点までのコミットメッセージを取得するか．デフォルトは最新まで．
+        :return: コミットメッセージのリスト．
+        """
+        timestamp = until.timestamp() if until else float('inf')
+        rows = self._conn.execute(
+            'SELECT message, committer_date FROM commits ORDER BY ordinal')
+        return [message for message, committer_date in rows
+                if committer_date <= timestamp]
+
+    def get_ordinal(self, commit_hash: str,
+                    until: Optional[datetime] = None) -> Optional[int]:
+        """
+        get_commit_hashes の結果における 1 始まりの順番を返す．
+        結果ファイル名の {index:06d} に対応する．
+        :param commit_hash: コミットハッシュ．
+        :param until: get_commit_hashes に与えたものと同じもの．
+        :return: 順番．存在しない場合は None．
+        """
+        key = until or datetime.max
+        if key not in self._ordinals:
+            self._ordinals[key] = {
+                h: i for i, h in enumerate(self.get_commit_hashes(until), 1)}
+        return self._ordinals[key].get(commit_hash)
+
+    def get_parents(self, commit_hash: str) -> list:
+        """
+        親のコミットハッシュを返す．
+        """
+        return list(self._parents[self._positions[commit_hash]])
+
+    def get_author_date(self, commit_hash: str) -> datetime:
+        """
+        author date を返す．
+        """
+        return datetime.fromtimestamp(
+            self._author_dates[self._positions[commit_hash]])
+
+    def get_message(self, commit_hash: str) -> str:
+        """
+        コミットメッセージを返す．
+        """
+        row = self._conn.execute('SELECT message FROM commits WHERE hash = ?',
+                                 (commit_hash,)).fetchone()
+        if row is None:
+            raise KeyError(commit_hash)
+        return row[0]
+
+    def get_changed_files(self, commit_hash: str) -> list:
+        """
+        そのコミットで変更のあったファイルを返す．
+        マージコミットの場合は親ごとの差分を連結したものになる．
+        """
+        row = self._conn.execute(
+            'SELECT changed_paths FROM commits WHERE hash = ?',
+            (commit_hash,)).fetchone()
+        if row is None:
+            raise KeyError(commit_hash)
+        return row[0].split('\0') if row[0] else []
+
+    def __contains__(self, commit_hash: str) -> bool:
+        return commit_hash in self._positions
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _load(self) -> None:
+        """
+        検索に使う列だけをメモリに載せる．
+        """
+        rows = self._conn.execute(
+            'SELECT hash, parents, author_date, committer_date '
+            'FROM commits ORDER BY ordinal').fetchall()
+        self._hashes = [row[0] for row in rows]
+        self._parents = [tuple(row[1].split()) for row in rows]
+        self._author_dates = [row[2] for row in rows]
+        self._committer_dates = [row[3] for row in rows]
+        self._positions = {h: i for i, h in enumerate(self._hashes)}
+        self._hashes_until = {}
+        self._ordinals = {}
+
+    def _iter_log(self, revision_range: str) -> Iterator[tuple]:
+        """
+        git log の出力を逐次読み込み，コミットごとの情報を返す．
+        """
+        cmd = ['git', '-C', str(self.repo_path), 'log', '--reverse', '-z',
+               '-m', '--name-only', LOG_FORMAT, revision_range, '--']
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as process:
+            for record in iter_records(process.stdout):
+                yield parse_record(record)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?',
+                                 (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           (key, value))
+
+
+def get_tip(repo_path: Path, branch_name: str) -> str:
+    """
+    ブランチの先頭のコミットハッシュを返す．
+    """
+    cmd = ['git', '-C', str(repo_path), 'rev-parse', f'refs/heads/{branch_name}']
+    return subprocess.run(cmd, check=True, capture_output=True,
+                          text=True).stdout.strip()
+
+
+def list_commits(repo_path: Path, tip: str) -> list:
+    """
+    tip から辿れるコミットハッシュを git log --reverse と同じ古い順で返す．
+    """
+    cmd = ['git', '-C', str(repo_path), 'rev-list', '--reverse', tip, '--']
+    return subprocess.run(cmd, check=True, capture_output=True,
+                          text=True).stdout.split()
+
+
+def is_ancestor(repo_path: Path, ancestor: str, descendant: str) -> bool:
+    """
+    ancestor が descendant の祖先であるかを判定する．
+    """
+    cmd = ['git', '-C', str(repo_path), 'merge-base',
+           '--is-ancestor', ancestor, descendant]
+    return subprocess.run(cmd, capture_output=True).returncode == 0
+
+
+def iter_records(stream, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    """
+    区切り文字 RECORD_SEP で区切られたレコードを順に返す．
+    :param stream: git log の標準出力．
+    :param chunk_size: 一度に読み込むバイト数．
+    """
+    buffer = b''
+    while chunk := stream.read(chunk_size):
+        buffer += chunk
+        *records, buffer = buffer.split(RECORD_SEP)
+        yield from (record for record in records if record)
+    if buffer:
+        yield buffer
+
+
+def parse_record(record: bytes) -> tuple:
+    """
+    git log の 1 レコードを (hash, parents, author_date, committer_date,
+    message, changed_paths) に変換する．
+    """
+    text = record.decode('utf-8', errors='replace')
+    commit_hash, parents, author_date, committer_date, rest \
+        = text.split(FIELD_SEP, 4)
+    message, _, names = rest.rpartition(FIELD_SEP)
+    changed_paths = [name.lstrip('\n') for name in names.split('\0')
+                     if name.strip('\n')]
+    return (commit_hash, parents, int(author_date), int(committer_date),
+            message, changed_paths)
+
+
+class ChangeCountTable:
+    """
+    ファイルごとの変更回数を 1 回の git log --name-status -M で数え，
+    コミットインデックスと同じ SQLite に保存するクラス．
+    リネームは追跡し，リネーム前の変更回数を引き継ぐ．
+    git log --follow と同様にマージコミットは数えず，リネーム前のパスの回数も残す．
+    """
+
+    def __init__(self, repo_path: Path, git_dir: Path, branch_name: str):
+        """
+        :param repo_path: リポジトリへのパス．
+        :param git_dir: .git ディレクトリへのパス．テーブルはここに保存する．
+        :param branch_name: 対象のブランチ名．
+        """
+        self.repo_path = repo_path
+        self.branch_name = branch_name
+        self._conn = sqlite3.connect(git_dir / CommitIndex.file_name)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS change_counts ('
+                           'path TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta ('
+                           'key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._counts = dict(self._conn.execute(
+            'SELECT path, count FROM change_counts'))
+        self.update()
+
+    def get_changed_times(self, file_path: str) -> int:
+        """
+        与えられたファイルが何回変更されたかを返す．
+        :param file_path: リポジトリのルートからの相対パス．
+        """
+        return self._counts.get(file_path, 0)
+
+    def update(self) -> None:
+        """
+        ブランチの先頭が前回から変わっていれば変更回数を更新する．
+        前回の先頭が祖先であれば差分だけを数え，そうでなければ数え直す．
+        """
+        tip = get_tip(self.repo_path, self.branch_name)
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?',
+                                 ('change_counts_tip',)).fetchone()
+        counted_tip = row[0] if row else None
+        if tip == counted_tip:
+            return
+
+        if counted_tip and is_ancestor(self.repo_path, counted_tip, tip):
+            revision_range = f'{counted_tip}..{tip}'
+        else:
+            revision_range = tip
+            self._counts.clear()
+            self._conn.execute('DELETE FROM change_counts')
+
+        touched = set()
+        for status, paths in self._iter_changes(revision_range):
+            if status.startswith('R'):
+                # 変更前のパスの回数は消さない．git log --follow はパスで履歴を絞ってから
+                # リネームをたどるので，後で同じパスに作られたファイルにはリネーム前の変更と
+                # リネームしたコミットも数える．
+                old_path, new_path = paths
+                old_count = self._counts.get(old_path, 0)
+                self._counts[new_path] = old_count + 1
+                self._counts[old_path] = old_count + 1
+                touched.update(paths)
+            else:
+                self._counts[paths[0]] = self._counts.get(paths[0], 0) + 1
+                touched.add(paths[0])
+
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO change_counts VALUES (?, ?)',
+            [(path, self._counts[path]) for path in touched])
+        self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           ('change_counts_tip', tip))
+        self._conn.commit()
+
+    def _iter_changes(self, revision_range: str) -> Iterator[tuple]:
+        """
+        古い順に (ステータス, パスのリスト) を返す．
+        リネームの場合のみパスは (変更前, 変更後) の 2 つになる．
+        """
+        cmd = ['git', '-C', str(self.repo_path), 'log', '--reverse', '-z',
+               '--no-merges', '--name-status', '-M', '--format=%x1e%H',
+               revision_range, '--']
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as process:
+            for record in iter_records(process.stdout):
+                text = record.decode('utf-8', errors='replace')
+                fields = [field.lstrip('\n') for field in text.split('\0')]
+                # 先頭はコミットハッシュ
+                fields = [field for field in fields[1:] if field]
+                i = 0
+                while i < len(fields):
+                    status = fields[i]
+                    width = 2 if status[0] in 'RC' else 1
+                    yield status, fields[i + 1:i + 1 + width]
+                    i += 1 + width
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
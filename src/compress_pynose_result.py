@@ -1,33 +1,61 @@
 """
 PyNose の結果は約 2 TB存在するのでそれらを圧縮するプログラム．
+セグメントストアに保存された結果はインデックスから列挙する．
+execute_pynose_per_commit.py で圧縮まで済ませる場合に使う CompressedResults と
+FusedResults も提供する．
 """
-import json
 import os
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                as_completed, wait)
+from functools import lru_cache
+from itertools import groupby
 from pathlib import Path
+from typing import Iterator, NamedTuple, Optional, Union
 
 from tqdm import tqdm
 
+from atomic_io import AtomicWriter, atomic_write
+import json_io
+from global_var import write_smell_bitsets
 from pynose_result_manager import PyNoseResultManager
+from result_store import (LooseResults, SegmentResults, SegmentStore,
+                          result_file_name)
+from smell_bitset import (count_smell_bitsets, open_test_case_names,
+                          smell_bitset_dir)
+
+
+class StoredResult(NamedTuple):
+    """
+    セグメントストアに保存された 1 コミット分の結果．
+    """
+    store_dir: Path
+    repo_name: str
+    ordinal: int
+    commit_hash: str
 
 
 def main():
     """
     不必要な情報を省き，見やすさを排除することで圧縮を図る．
+    入力は列挙しながら投入し，同時に処理中のバッチの数を抑えることでメモリを一定に保つ．
     """
     make_result_dirs()
 
     cpu_cnt = get_cpu_cnt()
     max_threads = cpu_cnt * 2
+    max_in_flight = max_threads * 2
 
-    file_paths = fast_rglob()
-    chunk_size = 10000
-    with ProcessPoolExecutor(max_threads) as executor:
-        with tqdm(total=len(file_paths)) as pbar:
-            for i in range(0, len(file_paths), chunk_size):
-                chunk = file_paths[i:i+chunk_size]
-                for _ in executor.map(compress, chunk):
-                    pbar.update()
+    with ProcessPoolExecutor(max_threads) as executor, tqdm() as pbar:
+        in_flight = {}
+        for repo_name, batch in iter_batches(batch_size=500):
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pbar.update(record_compressed(in_flight.pop(future),
+                                                  future.result()))
+            in_flight[executor.submit(compress_batch, batch)] = repo_name
+        for future in as_completed(in_flight):
+            pbar.update(record_compressed(in_flight[future], future.result()))
 
 
 def make_result_dirs():
@@ -44,16 +72,116 @@ def make_result_dirs():
         result_root.joinpath(dir_name).mkdir(exist_ok=True)
 
 
-def fast_rglob():
+def iter_batches(batch_size: int) -> Iterator[tuple[str, list]]:
+    """
+    まだ圧縮していない入力をリポジトリごとに batch_size 個ずつまとめて返す．
+    :param batch_size: 1 つのバッチに含める入力の数．
+    :return: リポジトリ名と入力のリストの組．
+    """
+    for repo_name, tasks in groupby(iter_tasks(), key=lambda task: task[0]):
+        batch = []
+        for _, task in tasks:
+            batch.append(task)
+            if len(batch) == batch_size:
+                yield repo_name, batch
+                batch = []
+        if batch:
+            yield repo_name, batch
+
+
+def iter_tasks() -> Iterator[tuple[str, Union[Path, StoredResult]]]:
     """
-    pathlib の rglob はリスト化のスピードが遅いので自前で実装する．
-    :return file_paths: 入力のファイルパス群．
+    os.scandir でリポジトリのディレクトリを 1 つずつ読みながら，
+    マニフェストに載っていない入力を返す．
+    セグメントストアに保存された結果はインデックスから列挙する．
+    :return: リポジトリ名と，入力のファイルパスもしくは StoredResult の組．
     """
     result_root = Path('../result/execute_pynose_per_commit').resolve()
-    result_dirs = result_root.glob('*')
-    file_paths = [file_path for result_dir in result_dirs
-                  for file_path in result_dir.glob('*.json')]
-    return file_paths
+    with os.scandir(result_root) as repo_entries:
+        for repo_entry in repo_entries:
+            if not repo_entry.is_dir():
+                continue
+            repo_name = repo_entry.name
+            compressed = load_manifest(repo_name)
+            with os.scandir(repo_entry.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json') \
+                            and 'error' not in entry.name \
+                            and entry.name not in compressed:
+                        yield repo_name, Path(entry.path)
+
+            store_dir = Path(repo_entry.path) / SegmentResults.dir_name
+            if not (store_dir / SegmentStore.index_file_name).exists():
+                continue
+            with SegmentStore(store_dir, read_only=True) as store:
+                for record in store.records():
+                    name = result_file_name(repo_name, record.ordinal,
+                                            record.commit_hash)
+                    if name not in compressed:
+                        yield repo_name, StoredResult(
+                            store_dir, repo_name, record.ordinal,
+                            record.commit_hash)
+
+
+def manifest_path(repo_name: str) -> Path:
+    """
+    圧縮済みの結果のファイル名を記録するマニフェストのパスを返す．
+    結果のディレクトリを glob する処理に混ざらないように，ディレクトリの隣に置く．
+    """
+    this_file_name = Path(__file__).stem
+    return Path('../result/').resolve() / this_file_name \
+        / f'{repo_name}.manifest'
+
+
+def load_manifest(repo_name: str) -> set:
+    """
+    圧縮済みの結果のファイル名を読み込む．
+    マニフェストがなければ，出力先を 1 度だけ列挙して作成する．
+    :param repo_name: リポジトリ名．
+    """
+    path = manifest_path(repo_name)
+    if path.exists():
+        with path.open() as f:
+            return {line.rstrip('\n') for line in f if line.endswith('\n')}
+
+    output_dir = path.parent / repo_name
+    with os.scandir(output_dir) as entries:
+        names = {entry.name for entry in entries
+                 if entry.name.endswith('.json')}
+    with atomic_write(path) as f:
+        f.writelines(f'{name}\n' for name in names)
+    return names
+
+
+def record_compressed(repo_name: str, names: list) -> int:
+    """
+    圧縮し終えた結果のファイル名をマニフェストに追記する．
+    :param repo_name: リポジトリ名．
+    :param names: 圧縮し終えた結果のファイル名．
+    :return: 処理した入力の数．
+    """
+    with manifest_path(repo_name).open('a') as f:
+        f.writelines(f'{name}\n' for name in names)
+    return len(names)
+
+
+def compress_batch(tasks: list) -> list:
+    """
+    ワーカープロセスで複数の入力をまとめて圧縮する．
+    出力はバッチの最後にまとめてディスクに書き込んでから置き換える．
+    :param tasks: 入力のファイルパスもしくは StoredResult のリスト．
+    :return: 圧縮し終えた結果のファイル名．
+    """
+    names = []
+    with AtomicWriter() as writer:
+        for task in tasks:
+            if isinstance(task, StoredResult):
+                output_file_path = compress_stored(task, writer)
+            else:
+                output_file_path = compress(task, writer)
+            if output_file_path is not None:
+                names.append(output_file_path.name)
+    return names
 
 
 def get_cpu_cnt():
@@ -63,24 +191,160 @@ def get_cpu_cnt():
     return os.cpu_count()
 
 
-def compress(input_file_path: Path):
+def compress(input_file_path: Path,
+             writer: Optional[AtomicWriter] = None) -> Optional[Path]:
     """
     解析に不要な情報を削除し，インデントも削除する．
+    :param input_file_path: PyNose の結果のファイルパス．
+    :param writer: 与えられた場合は，出力をこれに任せてまとめて確定させる．
+    :return: 出力先．すでに圧縮済みの場合も返す．対象外の場合は None．
     """
     this_file_name = Path(__file__).stem
     result_root = Path('../result/').resolve() / this_file_name
 
     output_file_path = result_root.joinpath(*input_file_path.parts[-2:])
     if output_file_path.exists():
-        return
+        return output_file_path
 
     if 'error' in output_file_path.name:
-        return
+        return None
 
-    result_manager = PyNoseResultManager(input_file_path)
-    compressed_result = result_manager.count_test_smells_per_file()
-    with output_file_path.open('w') as f:
-        json.dump(compressed_result, f)
+    result_manager = PyNoseResultManager(input_file_path, streaming=True)
+    write_smell_counts(result_manager, input_file_path.parent.name,
+                       output_file_path, writer)
+    return output_file_path
+
+
+def compress_stored(stored_result: StoredResult,
+                    writer: Optional[AtomicWriter] = None) -> Path:
+    """
+    セグメントストアに保存された結果を compress と同じように圧縮する．
+    :param stored_result: セグメントストアに保存された結果．
+    :param writer: 与えられた場合は，出力をこれに任せてまとめて確定させる．
+    :return: 出力先．
+    """
+    this_file_name = Path(__file__).stem
+    result_root = Path('../result/').resolve() / this_file_name
+
+    repo_name = stored_result.repo_name
+    output_file_path = result_root / repo_name / result_file_name(
+        repo_name, stored_result.ordinal, stored_result.commit_hash)
+    if output_file_path.exists():
+        return output_file_path
+
+    result_manager = PyNoseResultManager.from_store(
+        open_store(stored_result.store_dir), stored_result.commit_hash,
+        streaming=True)
+    write_smell_counts(result_manager, repo_name, output_file_path, writer)
+    return output_file_path
+
+
+def write_smell_counts(result_manager: PyNoseResultManager, repo_name: str,
+                       output_file_path: Path,
+                       writer: Optional[AtomicWriter] = None):
+    """
+    テストファイルごとのテストスメルの数を書き出す．
+    write_smell_bitsets が True ならばテストケースごとのビット列も
+    ../result/smell_bitset に同じファイル名で書き出し，数はビット列から集計する．
+    :param result_manager: PyNose の結果．
+    :param repo_name: リポジトリ名．
+    :param output_file_path: 出力先．
+    :param writer: 与えられた場合は，出力をこれに任せてまとめて確定させる．
+    """
+    if write_smell_bitsets:
+        bitsets = result_manager.encode_smell_bitsets(
+            open_test_case_names(repo_name))
+        bitset_dir = smell_bitset_dir(repo_name)
+        bitset_dir.mkdir(parents=True, exist_ok=True)
+        json_io.write(bitset_dir / output_file_path.name, bitsets,
+                      writer=writer)
+        compressed_result = count_smell_bitsets(bitsets)
+    else:
+        compressed_result = result_manager.count_test_smells_per_file()
+    json_io.write(output_file_path, compressed_result, writer=writer)
+
+
+class CompressedResults(LooseResults):
+    """
+    圧縮した結果をコミットごとの json ファイルとして保存する形式．
+    LooseResults と同じように扱えるが，put は PyNose の出力を圧縮して書き出す．
+    """
+
+    def put(self, index: int, commit_hash: str, file_path: Path) -> None:
+        """
+        PyNose が出力したファイルを圧縮して書き出す．元のファイルは残す．
+        """
+        result_manager = PyNoseResultManager(file_path, streaming=True)
+        write_smell_counts(result_manager, self.repo_name,
+                           self.path(index, commit_hash))
+
+
+class FusedResults:
+    """
+    PyNose の実行直後に圧縮した結果を書き出し，元の結果は設定に応じて残すか捨てる形式．
+    圧縮した結果か元の結果のいずれかがあれば解析済みとみなす．
+    """
+
+    def __init__(self, raw_results, compressed_results: CompressedResults,
+                 keep_raw: bool):
+        """
+        :param raw_results: 元の結果の保存先．LooseResults もしくは SegmentResults．
+        :param compressed_results: 圧縮した結果の保存先．
+        :param keep_raw: True ならば元の結果も残す．
+        """
+        self.raw_results = raw_results
+        self.compressed_results = compressed_results
+        self.keep_raw = keep_raw
+
+    def contains(self, index: int, commit_hash: str) -> bool:
+        """
+        圧縮した結果か元の結果のいずれかがあれば解析済みである．
+        """
+        return self.compressed_results.contains(index, commit_hash) \
+            or self.raw_results.contains(index, commit_hash)
+
+    def put(self, index: int, commit_hash: str, file_path: Path) -> None:
+        """
+        PyNose が出力したファイルを圧縮して書き出し，元のファイルを残すか削除する．
+        """
+        self.compressed_results.put(index, commit_hash, file_path)
+        if self.keep_raw:
+            self.raw_results.put(index, commit_hash, file_path)
+        else:
+            file_path.unlink()
+
+    def reuse(self, index: int, commit_hash: str,
+              src_index: int, src_commit_hash: str) -> None:
+        """
+        存在する方の結果を使い回す．
+        """
+        if self.compressed_results.contains(src_index, src_commit_hash):
+            self.compressed_results.reuse(index, commit_hash,
+                                          src_index, src_commit_hash)
+        if self.raw_results.contains(src_index, src_commit_hash):
+            self.raw_results.reuse(index, commit_hash,
+                                   src_index, src_commit_hash)
+
+    def read(self, index: int, commit_hash: str) -> Optional[bytes]:
+        """
+        元の結果を読み込む．存在しない場合は None．
+        """
+        return self.raw_results.read(index, commit_hash)
+
+    def close(self) -> None:
+        """
+        元の結果の保存先を閉じる．
+        """
+        self.raw_results.close()
+
+
+@lru_cache(maxsize=None)
+def open_store(store_dir: Path) -> SegmentStore:
+    """
+    セグメントストアを開く．プロセスごとに 1 度だけ開く．
+    解析中のストアを修復しないように，読み込み専用で開く．
+    """
+    return SegmentStore(store_dir, read_only=True)
 
 
 if __name__ == '__main__':
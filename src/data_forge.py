@@ -2,7 +2,6 @@
 今までのデータを統合し，実際に使用できるデータ型にする．
 ただし，間引きなどの処理もこちらで行う．
 """
-import json
 from pathlib import Path
 from radon.complexity import cc_visit
 from radon.raw import analyze
@@ -11,8 +10,10 @@ from typing import Optional
 
 from tqdm import tqdm
 
+import json_io
 from global_var import deadline
 from repo import Repo
+from smell_matrix import load_smell_matrix
 
 
 def main():
@@ -33,37 +34,35 @@ def main():
     for target in tqdm(target_list):
         result = {}
         repo = Repo(target)
-        repo_name = target.name
         result_file_path = result_dir / target.name / f'{target.name}.json'
         result_file_path.parent.mkdir(exist_ok=True)
         if result_file_path.exists():
-            with result_file_path.open() as f:
-                result = json.load(f)
-                if result:
-                    aggregated[repo.get_clone_url()] = result
+            result = json_io.read(result_file_path)
+            if result:
+                aggregated[repo.get_clone_url()] = result
             continue
 
         mapping_dict = get_mapping_dict(target.name)
         filter_prod_path(repo, mapping_dict)
+        latest_commit_hash = repo.get_commit_hashes(until=deadline)[-1]
 
         for prod_path, test_files in tqdm(list(mapping_dict.items()),
                                           leave=False):
             pynose_result, test_files, bug_detected_commit \
-                = get_pynose_result_for_product(repo_name, prod_path,
+                = get_pynose_result_for_product(repo, prod_path,
                                                 mapping_dict, test_files)
             if not pynose_result:
                 continue
 
             if bug_detected_commit:
                 bug = 1
-                repo.checkout(bug_detected_commit)
+                commit_hash = bug_detected_commit
             else:
                 bug = 0
-                commit_hashes = repo.get_commit_hashes(until=deadline)
-                repo.checkout(commit_hashes[-1])
+                commit_hash = latest_commit_hash
 
-            prod_metrics = get_prod_metrics(repo.repo_path / prod_path)
-            test_metrics = get_test_metrics(repo.repo_path, test_files)
+            prod_metrics = get_prod_metrics(repo, commit_hash, prod_path)
+            test_metrics = get_test_metrics(repo, commit_hash, test_files)
 
             if prod_metrics is None:
                 continue
@@ -73,14 +72,12 @@ def main():
             store_result(result, prod_path, prod_metrics,
                          test_files, test_metrics, pynose_result, bug)
 
-        with result_file_path.open('w') as f:
-            json.dump(result, f, indent=4)
+        json_io.write(result_file_path, result)
 
         if result:
             aggregated[repo.get_clone_url()] = result
 
-    with aggregated_file_path.open('w') as f:
-        json.dump(aggregated, f, indent=4)
+    json_io.write(aggregated_file_path, aggregated)
 
 
 def get_mapping_dict(repo_name: str) -> dict:
@@ -91,8 +88,7 @@ def get_mapping_dict(repo_name: str) -> dict:
     """
     result_files = Path(f'../result/mapping_prod_to_test/{repo_name}').glob('*')
     latest_file = sorted(list(result_files), key=lambda x: x.name)[-1]
-    with latest_file.open() as f:
-        mapping_result = json.load(f)
+    mapping_result = json_io.read(latest_file)
 
     converted_result = {}
     for prod_path, test_path_list in mapping_result.items():
@@ -102,27 +98,39 @@ def get_mapping_dict(repo_name: str) -> dict:
     return converted_result
 
 
-def get_test_files(repo_name: str, bug_detected_commit: str,
+def find_result_file(result_dir: Path, repo: Repo,
+                     commit_hash: str) -> Optional[Path]:
+    """
+    コミットハッシュに対応する結果ファイルを取得する．
+    ファイル名はコミットインデックスの順番から組み立てるので，ディレクトリを走査しない．
+    :param result_dir: 結果が格納されているディレクトリ．
+    :param repo: リポジトリを操作するクラス．
+    :param commit_hash: 検索対象のコミットハッシュ．
+    :return: 結果ファイルのパス．存在しなければ None．
+    """
+    ordinal = repo.commit_index.get_ordinal(commit_hash, until=deadline)
+    if ordinal is None:
+        return None
+    result_file = result_dir / f'{repo.name}_{ordinal:06d}_{commit_hash}.json'
+    return result_file if result_file.exists() else None
+
+
+def get_test_files(repo: Repo, bug_detected_commit: str,
                    mapping_dict: dict, prod_path: Path) -> list[Path]:
     """
     mapping_prod_to_test.py の結果から
     製品コードとそれをテストしているテストコードの一覧を取得する．
     もしもヒットしなければ間引く．
-    :param repo_name: 結果が格納されているディレクトリの名前．
+    :param repo: リポジトリを操作するクラス．
     :param bug_detected_commit: 検索対象のコミット．
     :param mapping_dict: 製品コードの辞書．
     :param prod_path: 製品コードのパス．
     """
-    target_file = None
-    result_files = Path(f'../result/mapping_prod_to_test/{repo_name}').glob('*')
-    for result_file in result_files:
-        if bug_detected_commit in result_file.as_posix():
-            target_file = result_file
-            break
+    result_dir = Path(f'../result/mapping_prod_to_test/{repo.name}')
+    target_file = find_result_file(result_dir, repo, bug_detected_commit)
 
     try:
-        with target_file.open() as f:
-            mapping_result = json.load(f)
+        mapping_result = json_io.read(target_file)
         test_files = [Path(test_file)
                       for test_file in mapping_result[prod_path.as_posix()]]
         return list(set(test_files))
@@ -151,7 +159,7 @@ def filter_prod_path(repo: Repo, mapping_dict: dict):
             del mapping_dict[prod_path]
 
 
-def get_pynose_result_for_product(repo_name: str, prod_path: Path,
+def get_pynose_result_for_product(repo: Repo, prod_path: Path,
                                   mapping_dict: dict, test_files: list[Path]):
     """
     指定された製品コードに対して、PyNose の解析結果を取得する．
@@ -161,20 +169,20 @@ def get_pynose_result_for_product(repo_name: str, prod_path: Path,
     バグ修正履歴が存在しない場合は，
       get_latest_pynose_result を用いて最新の解析結果を取得する．
 
-    :param repo_name: 結果が格納されているディレクトリの名前．
+    :param repo: リポジトリを操作するクラス．
     :param prod_path: 対象の製品コードのパス．
     :param mapping_dict: 製品コードと対応するテストコード群のマッピング辞書．
     :param test_files: 製品コードをテストしているテストコード群のパスのリスト．
     """
-    bug_detected_commit = has_bug_history(repo_name, prod_path)
+    bug_detected_commit = has_bug_history(repo.name, prod_path)
     if bug_detected_commit:
-        test_files = get_test_files(repo_name, bug_detected_commit,
+        test_files = get_test_files(repo, bug_detected_commit,
                                     mapping_dict, prod_path)
         pynose_result = get_pynose_result(prod_path, bug_detected_commit,
-                                          repo_name, mapping_dict, test_files)
+                                          repo, mapping_dict, test_files)
     else:
         test_files = list(set(test_files))
-        pynose_result = get_latest_pynose_result(prod_path, repo_name,
+        pynose_result = get_latest_pynose_result(prod_path, repo.name,
                                                  mapping_dict, test_files)
     return pynose_result, test_files, bug_detected_commit
 
@@ -192,8 +200,7 @@ def has_bug_history(repo_name: str, prod_path: Path) -> Optional[str]:
     """
     result_root = Path(f'../result/get_changed_files_before_merge')
     result_file_path = result_root / repo_name / f'{repo_name}.json'
-    with result_file_path.open() as f:
-        bug_fix_data_list = json.load(f)
+    bug_fix_data_list = json_io.read(result_file_path)
 
     base_commit = None
     for bug_fix_data in bug_fix_data_list:
@@ -204,31 +211,36 @@ def has_bug_history(repo_name: str, prod_path: Path) -> Optional[str]:
 
 
 def get_pynose_result(prod_path: Path, bug_detected_commit: str,
-                      repo_name: str, mapping_dict: dict,
+                      repo: Repo, mapping_dict: dict,
                       test_files: list[Path]):
     """
     指定されたコミットハッシュの PyNose の結果を取得する．
+    smell_matrix.py で作成した行列が最新であればそちらから引く．
     ただし，対応するファイルが存在しないか prod_path に対応するものがなければ間引く．
     :param prod_path: 対象の製品コードのパス．
     :param bug_detected_commit: 検索対象のコミットハッシュ．
-    :param repo_name: 結果が格納されているディレクトリの名前．
+    :param repo: リポジトリを操作するクラス．
     :param mapping_dict: 製品コードの対応付けされた辞書．
     :param test_files: prod_path をテストしているコードのリスト．
     """
     if not test_files:
         return None
 
-    target_file = None
-    result_root = Path(f'../result/compress_pynose_result')
-    result_files = Path(f'{result_root}/{repo_name}').glob('*')
-    for result_file in result_files:
-        if bug_detected_commit in result_file.as_posix():
-            target_file = result_file
-            break
+    smell_matrix = load_smell_matrix(repo.name)
+    if smell_matrix is not None:
+        try:
+            return smell_matrix.sum_files(
+                bug_detected_commit,
+                [test_file.name for test_file in test_files])
+        except KeyError:
+            del mapping_dict[prod_path]
+            return None
+
+    result_dir = Path(f'../result/compress_pynose_result/{repo.name}')
+    target_file = find_result_file(result_dir, repo, bug_detected_commit)
 
     try:
-        with target_file.open() as f:
-            pynose_result = json.load(f)
+        pynose_result = json_io.read(target_file)
         result = {}
         for test_file in test_files:
             smell_data = pynose_result[test_file.name]
@@ -247,17 +259,27 @@ def get_latest_pynose_result(prod_path: Path,
                              test_files: list[Path]) -> dict:
     """
     最新の PyNose の結果を取得する．
+    smell_matrix.py で作成した行列が最新であればそちらから引く．
     ただし， prod_path に対応するものがなければ間引く．
     :param prod_path: 対象の製品コードのパス．
     :param repo_name: 結果が格納されているディレクトリの名前．
     :param mapping_dict: 製品コードの対応付けされた辞書．
     :param test_files: prod_path をテストしているコードのリスト．
     """
+    smell_matrix = load_smell_matrix(repo_name)
+    if smell_matrix is not None:
+        try:
+            return smell_matrix.sum_files(
+                smell_matrix.get_latest_ordinal(),
+                [test_file.name for test_file in test_files])
+        except KeyError:
+            del mapping_dict[prod_path]
+            return None
+
     result_root = Path(f'../result/compress_pynose_result')
     result_files = Path(f'{result_root}/{repo_name}').glob('*')
     latest_file = sorted(list(result_files), key=lambda x: x.name)[-1]
-    with latest_file.open() as f:
-        pynose_result = json.load(f)
+    pynose_result = json_io.read(latest_file)
 
     try:
         result = {}
@@ -270,25 +292,29 @@ def get_latest_pynose_result(prod_path: Path,
         del mapping_dict[prod_path]
 
 
-def get_prod_metrics(prod_path: Path) -> Optional[dict]:
+def get_prod_metrics(repo: Repo, commit_hash: str,
+                     prod_path: Path) -> Optional[dict]:
     """
     製品コードのメトリクスを取得する．
-    :param prod_path: ファイルへのパス．
+    :param repo: リポジトリを操作するクラス．
+    :param commit_hash: 対象のコミットハッシュ．
+    :param prod_path: リポジトリのルートからのファイルパス．
     """
-    return get_metrics(prod_path)
+    return get_metrics(repo, commit_hash, prod_path)
 
 
-def get_test_metrics(repo_path: Path, test_files: list[Path]) -> Optional[dict]:
+def get_test_metrics(repo: Repo, commit_hash: str,
+                     test_files: list[Path]) -> Optional[dict]:
     """
     製品コードのメトリクスを取得する．
-    :param repo_path: リポジトリへのパス．
+    :param repo: リポジトリを操作するクラス．
+    :param commit_hash: 対象のコミットハッシュ．
     :param test_files: テストファイルのリスト．
     """
     result = {}
     tmp = []
     for test_file in test_files:
-        test_file_path = repo_path / test_file
-        metrics = get_metrics(test_file_path)
+        metrics = get_metrics(repo, commit_hash, test_file)
         if metrics is not None:
             tmp.append(metrics)
 
@@ -315,20 +341,22 @@ def ave(num_list: list):
     return sum(num_list) / len(num_list)
 
 
-def get_metrics(file_path: Path) -> Optional[dict]:
+def get_metrics(repo: Repo, commit_hash: str,
+                file_path: Path) -> Optional[dict]:
     """
     コードのメトリクスを取得する，
-    :param file_path: ファイルへのパス．
+    ファイルはチェックアウトせずにオブジェクトデータベースから読み込む．
+    :param repo: リポジトリを操作するクラス．
+    :param commit_hash: 対象のコミットハッシュ．
+    :param file_path: リポジトリのルートからのファイルパス．
     """
-    assert file_path.exists()
-
     metrics = {}
     try:
-        with file_path.open(encoding='utf-8-sig') as file:
-            code = file.read()
+        code = repo.read_text(commit_hash, file_path, encoding='utf-8-sig')
     except Exception as e:  # noqa
         print(e)
         return None
+    assert code is not None
 
     try:
         raw_metrics = analyze(code)
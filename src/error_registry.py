@@ -0,0 +1,110 @@
+"""
+PyNose の解析でエラーとなったコミットを記録する python API を提供するモジュール．
+"""
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+import json_io
+
+
+class ErrorRegistry:
+    """
+    エラーとなったコミットハッシュと理由を 1 行ずつ追記し，
+    読み込み時に 1 度だけ辞書に載せて O(1) で判定できるようにするクラス．
+
+    {repo}_error.log の各行は「コミットハッシュ<TAB>理由」であり，
+    同じコミットが複数回記録された場合は最後の行が優先される．
+    以前の形式の {repo}_error.json が残っている場合はそれも読み込む．
+    """
+    # 重複した行がこの割合を超えたら読み込み時に圧縮する
+    compaction_ratio = 2
+
+    def __init__(self, result_dir: Path, repo_name: str,
+                 read_only: bool = False):
+        """
+        :param result_dir: 結果を格納するディレクトリ．
+        :param repo_name: リポジトリ名．
+        :param read_only: True ならば圧縮しない．解析中の記録を読むときに使う．
+        """
+        self.path = result_dir / f'{repo_name}_error.log'
+        self.legacy_path = result_dir / f'{repo_name}_error.json'
+        self._reasons: dict[str, str] = {}
+        self._line_cnt = 0
+        self._lock = threading.Lock()
+
+        truncated = False
+        if self.legacy_path.exists():
+            self._reasons.update(json_io.read(self.legacy_path))
+        if self.path.exists():
+            with self.path.open() as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        truncated = True  # 書き込み中に中断された行
+                        continue
+                    commit_hash, _, reason = line.rstrip('\n').partition('\t')
+                    self._reasons[commit_hash] = reason
+                    self._line_cnt += 1
+
+        if read_only:
+            return
+        if truncated or self.legacy_path.exists() \
+                or self._line_cnt > len(self._reasons) * self.compaction_ratio:
+            self.compact()
+
+    def __contains__(self, commit_hash: str) -> bool:
+        return commit_hash in self._reasons
+
+    def __len__(self) -> int:
+        return len(self._reasons)
+
+    def record(self, commit_hash: str, reason: str) -> None:
+        """
+        エラーとなったコミットハッシュを追記する．
+        :param commit_hash: コミットハッシュ．
+        :param reason: エラーと判断した理由．
+        """
+        with self._lock:
+            with self.path.open('a') as f:
+                f.write(f'{commit_hash}\t{reason}\n')
+            self._reasons[commit_hash] = reason
+            self._line_cnt += 1
+
+    def get_reason(self, commit_hash: str) -> Optional[str]:
+        """
+        エラーとなった理由を返す．
+        :param commit_hash: コミットハッシュ．
+        :return: 理由．エラーとなっていない場合は None．
+        """
+        return self._reasons.get(commit_hash)
+
+    def get_commit_hashes(self, reason: str) -> list:
+        """
+        指定した理由でエラーとなったコミットハッシュを返す．
+        :param reason: エラーと判断した理由．
+        """
+        return [commit_hash for commit_hash, r in self._reasons.items()
+                if r == reason]
+
+    def count_reasons(self) -> Counter:
+        """
+        理由ごとのエラーとなったコミットの数を返す．
+        """
+        return Counter(self._reasons.values())
+
+    def compact(self) -> None:
+        """
+        1 コミット 1 行に書き直し，以前の形式のファイルを取り込んで削除する．
+        書き込み途中で中断されても元のファイルが残るように置き換える．
+        """
+        with self._lock:
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with tmp_path.open('w') as f:
+                for commit_hash, reason in self._reasons.items():
+                    f.write(f'{commit_hash}\t{reason}\n')
+            os.replace(tmp_path, self.path)
+            self._line_cnt = len(self._reasons)
+            if self.legacy_path.exists():
+                self.legacy_path.unlink()
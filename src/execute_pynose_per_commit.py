@@ -1,15 +1,25 @@
 """
 PyNose をコミットごとに実行するプログラム．
+1 つのリポジトリのコミットを複数のワーカーに分配して並列に解析する．
+use_test_fingerprint が True ならば，.py ファイルが解析済みのコミットと同じコミットは結果を使い回す．
 """
-import json
-import shutil
+import hashlib
+import queue
 import sys
-import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import NamedTuple, Optional, Union
 
-from global_var import deadline, runner_path
-from pynose_executor import PyNoseExecutor
+from compress_pynose_result import CompressedResults, FusedResults
+from error_registry import ErrorRegistry
+from global_var import (deadline, fuse_compression, pynose_worker_cnt,
+                        raw_result_retention, use_segment_store,
+                        use_test_fingerprint)
+from object_reader import ObjectReader
+from pynose_executor import TimeoutPolicy
+from pynose_worker import PyNoseWorker, remove_dir
 from repo import Repo
+from result_store import log_file_name, open_results
 
 
 def main():
@@ -28,15 +38,9 @@ def main():
         if not start <= prefix_number <= end:
             continue
 
-        pynose_instance_path = Path(f'../{repo_prefix.stem}_PyNose').resolve()
-        if pynose_instance_path.exists():
-            shutil.rmtree(pynose_instance_path)
-        shutil.copytree(runner_path.parent, pynose_instance_path)
-
         try:
             repo_name = repo_prefix.glob('*').__next__().stem
         except StopIteration:
-            shutil.rmtree(pynose_instance_path)
             continue
         repo_path = repo_prefix / repo_name
         repo = Repo(repo_path)
@@ -44,116 +48,240 @@ def main():
         result_dir \
             = Path(f'../result/{this_file_name}/{repo_name}').resolve()
         result_dir.mkdir(exist_ok=True, parents=True)
-        pynose_executor = PyNoseExecutor(
-            runner_path=pynose_instance_path / 'runner.py',
-            result_dir=result_dir,
-            repo_prefix=repo_prefix
-        )
-
-        commit_hashes = repo.get_commit_hashes(until=deadline)
-        default_result_file_path = result_dir / f'{repo_name}.json'
-        default_log_file_path = result_dir / 'log.txt'
-        error_recorded_file_path = result_dir / f'{repo_name}_error.json'
-        for index, commit_hash in enumerate(commit_hashes, 1):
-            result_file_name = f'{repo_name}_{index:06d}_{commit_hash}.json'
-            log_file_name = f'{repo_name}_{index:06d}_{commit_hash}.txt'
-
-            result_file_path = result_dir / result_file_name
-            log_file_path = result_dir / log_file_name
-            if already_analyzed(result_file_path):
-                print(f'skip {commit_hash}')
-                continue
-
-            if error_commit_hash(error_recorded_file_path, commit_hash):
-                print(f'skip {commit_hash} due to some error')
-                continue
-
-            repo.checkout(commit_hash)
-
-            try:
-                pynose_executor.execute_pynose()
-            except KeyboardInterrupt:
-                remove_pynose_dir(pynose_instance_path)
-                sys.exit(0)
-            except TimeoutError:
-                record_error_commit_hash(commit_hash, 'Timeout',
-                                         error_recorded_file_path)
-                continue
-            finally:
-                print(f'{repo_name} {index}/{len(commit_hashes)}')
-
-            try:
-                default_result_file_path.rename(result_file_path)
-                default_log_file_path.unlink()
-            except FileNotFoundError:
-                print('PyNose did not output result file')
-                record_error_commit_hash(commit_hash, 'OnlyLogFile',
-                                         error_recorded_file_path)
-                try:
-                    default_log_file_path.rename(log_file_path)
-                except FileNotFoundError:
-                    print('PyNose did not output log file')
-
-        if pynose_instance_path.exists():
-            shutil.rmtree(pynose_instance_path)
-
-
-def already_analyzed(file_path: Path):
-    """
-    すでにファイルが存在しているならば解析済みである．
-    :param file_path: 結果のファイルパス．
-    :return: file_path が存在しているかどうか．
-    """
-    return file_path.exists()
-
-
-def remove_pynose_dir(dir_path: Path):
-    """
-    PyNose を削除しようと試みる．
-    :param dir_path: PyNose へのパス．
+        work_root = Path(f'../{repo_prefix.stem}_PyNose').resolve()
+        execute_per_repo(repo, result_dir, work_root, pynose_worker_cnt)
+
+
+def execute_per_repo(repo: Repo, result_dir: Path, work_root: Path,
+                     worker_cnt: int):
     """
+    リポジトリのコミットをワーカーに分配して PyNose を実行する．
+    各ワーカーは自分専用の worktree と PyNose を持つ．
+    :param repo: 解析対象のリポジトリ．
+    :param result_dir: 結果を格納するディレクトリ．
+    :param work_root: ワーカーのディレクトリを作成するディレクトリ．
+    :param worker_cnt: ワーカーの数．
+    """
+    results = open_pynose_results(result_dir, repo.name)
+    errors = ErrorRegistry(result_dir, repo.name)
+    timeout_policy = TimeoutPolicy(result_dir / attempts_file_name(repo))
+    jobs = plan_jobs(repo, results, errors)
+    if not jobs:
+        results.close()
+        return
+
+    worker_cnt = min(worker_cnt, len(jobs))
+    workers = [PyNoseWorker(work_root / f'{i:02d}') for i in range(worker_cnt)]
+    idle_workers = queue.Queue()
+    for worker in workers:
+        idle_workers.put(worker)
+
+    def analyze(job: CommitJob):
+        worker = idle_workers.get()
+        try:
+            return analyze_job(worker, repo, job, results, result_dir,
+                               timeout_policy)
+        finally:
+            idle_workers.put(worker)
+
+    executor = ThreadPoolExecutor(worker_cnt)
+    interrupted = False
     try:
-        shutil.rmtree(dir_path)
-    except FileNotFoundError:
-        time.sleep(3)
-        shutil.rmtree(dir_path)
-    except OSError:
-        time.sleep(3)
-        shutil.rmtree(dir_path)
+        futures = {executor.submit(analyze, job): job for job in jobs}
+        total = len(jobs)
+        finished = 0
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                retry = finish_job(results, errors, futures.pop(future),
+                                   future.result())
+                if retry is not None:
+                    futures[executor.submit(analyze, retry)] = retry
+                    total += 1
+                finished += 1
+                print(f'{repo.name} {finished}/{total}')
+    except KeyboardInterrupt:
+        interrupted = True
+    finally:
+        # 中断した場合は実行中の PyNose を待たない
+        executor.shutdown(wait=not interrupted, cancel_futures=True)
+        close_workers(workers, work_root)
+        results.close()
+    if interrupted:
+        sys.exit(0)
+
+
+def open_pynose_results(result_dir: Path, repo_name: str):
+    """
+    設定に応じて結果の保存先を開く．
+    fuse_compression が True ならば圧縮した結果も書き出す．
+    :param result_dir: 結果を格納するディレクトリ．
+    :param repo_name: リポジトリ名．
+    """
+    results = open_results(result_dir, repo_name, use_segment_store)
+    if not fuse_compression:
+        return results
+
+    compressed_dir = Path('../result/compress_pynose_result').resolve() \
+        / repo_name
+    compressed_dir.mkdir(exist_ok=True, parents=True)
+    return FusedResults(results, CompressedResults(compressed_dir, repo_name),
+                        keep_raw=raw_result_retention == 'keep')
+
+
+# 同じ .py ファイルに対して PyNose を実行し直しても変わらない失敗の理由
+deterministic_reasons = frozenset({'OnlyLogFile'})
+
+
+class CommitJob(NamedTuple):
+    """
+    PyNose を実行するコミットと，その結果を使い回すコミット．
+    """
+    index: int
+    commit_hash: str
+    followers: list[tuple[int, str]]
+
+
+def plan_jobs(repo: Repo, results, errors: ErrorRegistry) -> list[CommitJob]:
+    """
+    PyNose を実行するコミットを決める．
+    use_test_fingerprint が True ならば，.py ファイルのパスと中身がより前のコミットと
+    まったく同じコミットは PyNose を実行せず，そのコミットの結果を使い回す．
+    :param repo: 解析対象のリポジトリ．
+    :param results: 結果の保存先．LooseResults もしくは SegmentResults．
+    :param errors: 前回までの解析でエラーとなったコミット．
+    :return: PyNose を実行するコミットのリスト．
+    """
+    commit_hashes = repo.get_commit_hashes(until=deadline)
+    analyzed = []
+    pending = []
+    for index, commit_hash in enumerate(commit_hashes, 1):
+        if results.contains(index, commit_hash):
+            analyzed.append(True)
+            pending.append(False)
+            continue
+        analyzed.append(False)
+        if commit_hash in errors:
+            print(f'skip {commit_hash} due to some error')
+            pending.append(False)
+            continue
+        pending.append(True)
+
+    # 最後に解析するコミットより後のコミットの結果は使い回されない
+    last_pending = max((i for i, p in enumerate(pending) if p), default=-1)
+    jobs = []
+    # 指紋ごとの，同じ .py ファイルを持つコミット群の代表
+    heads: dict[str, Union[CommitJob, tuple[int, str]]] = {}
+    for i, commit_hash in enumerate(commit_hashes[:last_pending + 1]):
+        index = i + 1
+        if not analyzed[i] and not pending[i]:
+            continue
+        fingerprint = source_fingerprint(repo, commit_hash) \
+            if use_test_fingerprint else None
+        head = heads.get(fingerprint)
+
+        if analyzed[i]:
+            if fingerprint is not None and head is None:
+                heads[fingerprint] = (index, commit_hash)
+        elif head is None:
+            job = CommitJob(index, commit_hash, [])
+            jobs.append(job)
+            if fingerprint is not None:
+                heads[fingerprint] = job
+        elif isinstance(head, CommitJob):
+            head.followers.append((index, commit_hash))
+        else:
+            print(f'reuse the result of {head[1]} for {commit_hash}')
+            results.reuse(index, commit_hash, *head)
+    return jobs
+
+
+def finish_job(results, errors: ErrorRegistry, job: CommitJob,
+               reason: Optional[str]) -> Optional[CommitJob]:
+    """
+    PyNose の実行結果を後続のコミットに反映する．
+    .py ファイルが同じなので，PyNose が結果を出力しなかった場合は後続のコミットも失敗とみなす．
+    タイムアウトや例外はそのコミットに限った失敗でありうるため，後続のコミットは改めて解析する．
+    :param results: 結果の保存先．
+    :param errors: エラーを記録する先．
+    :param job: 実行したコミット．
+    :param reason: 失敗した理由．成功した場合は None．
+    :return: 後続のコミットを改めて解析する場合は，その先頭を代表とするジョブ．
+    """
+    if reason:
+        errors.record(job.commit_hash, reason)
+        if reason not in deterministic_reasons:
+            if not job.followers:
+                return None
+            (index, commit_hash), *followers = job.followers
+            return CommitJob(index, commit_hash, followers)
+        for _, commit_hash in job.followers:
+            errors.record(commit_hash, reason)
+        return None
+
+    for index, commit_hash in job.followers:
+        results.reuse(index, commit_hash, job.index, job.commit_hash)
+    return None
 
 
-def record_error_commit_hash(commit_hash: str, reason: str, path: Path):
+def analyze_job(worker: PyNoseWorker, repo: Repo, job: CommitJob, results,
+                result_dir: Path, timeout_policy: TimeoutPolicy) \
+        -> Optional[str]:
     """
-    解析時にエラーとなったコミットハッシュを記録する．
-    :param commit_hash: コミットハッシュ．
-    :param reason: エラーと判断した理由．
-    :param path: 記録するファイルのパス．
+    ワーカーにコミットを解析させる．
+    PyNose やチェックアウトが例外を投げた場合は，リポジトリ全体を止めずにそのコミットの失敗とする．
+    :param worker: 解析させるワーカー．
+    :param repo: 解析対象のリポジトリ．
+    :param job: 解析するコミット．
+    :param results: 結果の保存先．
+    :param result_dir: 結果を格納するディレクトリ．ログの移動先に使う．
+    :param timeout_policy: 解析対象のリポジトリのタイムアウトの決め方．
+    :return: 失敗した場合はその理由．成功した場合は None．
     """
-    if not path.exists():
-        error_dict = {}
-    else:
-        with path.open() as f:
-            error_dict = json.load(f)
+    try:
+        return worker.analyze(
+            repo, job.index, job.commit_hash, results,
+            result_dir / log_file_name(repo.name, job.index, job.commit_hash),
+            timeout_policy)
+    except Exception as e:
+        print(f'{repo.name} {job.commit_hash} failed: {e!r}')
+        return type(e).__name__
+
 
-    error_dict[commit_hash] = reason
-    with path.open('w') as f:
-        json.dump(error_dict, f, indent=4)
-        f.write("\n")
+def source_fingerprint(repo: Repo, commit_hash: str) -> str:
+    """
+    コミットに含まれるすべての .py ファイルのパスと blob のハッシュから指紋を作る．
+    PyNose は基底クラスを他のファイルから探すため，テストファイル以外も含める．
+    ディレクトリへのシンボリックリンクは読まれるファイルを変えうるため，シンボリックリンクもすべて含める．
+    :param repo: 対象のリポジトリ．
+    :param commit_hash: 対象のコミットハッシュ．
+    """
+    fingerprint = hashlib.sha1()
+    for entry in repo.list_tree(commit_hash):
+        if entry.path.endswith('.py') \
+                or entry.mode == ObjectReader.symlink_mode:
+            fingerprint.update(f'{entry.path}\0{entry.object_id}\0'
+                               .encode('utf-8', 'surrogateescape'))
+    return fingerprint.hexdigest()
 
 
-def error_commit_hash(path: Path, commit_hash: str):
+def close_workers(workers: list[PyNoseWorker], work_root: Path):
     """
-    前回の解析でエラーと判断されたコミットハッシュ群に，
-    与えられたコミットハッシュが含まれているかを判定する．
-    :param path: エラーが記録されているファイルのパス．
-    :param commit_hash: 判定するコミットハッシュ．
+    ワーカーを終了させ，ワーカーのディレクトリを削除する．
+    :param workers: ワーカーのリスト．
+    :param work_root: ワーカーのディレクトリを作成したディレクトリ．
     """
-    if not path.exists():
-        return False
+    for worker in workers:
+        worker.close()
+    if work_root.exists():
+        remove_dir(work_root)
+
 
-    with path.open() as f:
-        errors = f.read()
-    return True if commit_hash in errors else False
+def attempts_file_name(repo: Repo) -> str:
+    """
+    PyNose の試行の記録のファイル名を返す．
+    """
+    return f'{repo.name}_attempts.jsonl'
 
 
 if __name__ == '__main__':
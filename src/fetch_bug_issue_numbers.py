@@ -2,7 +2,6 @@
 GitHub Rest Api を用いてリポジトリの issues を取得し，
 そこからバグに関する issue の番号を取得する，
 """
-import json
 import os
 from pathlib import Path
 
@@ -10,6 +9,7 @@ import requests
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+import json_io
 from repo import Repo
 
 
@@ -33,8 +33,7 @@ def main():
         result_file_path = result_dir / target.name / f'{target.name}.json'
         result_file_path.parent.mkdir(exist_ok=True)
         if result_file_path.exists():
-            with result_file_path.open() as f:
-                aggregated[target.name] = json.load(f)
+            aggregated[target.name] = json_io.read(result_file_path)
             continue
 
         api_url = make_api_url(Repo(target))
@@ -44,13 +43,11 @@ def main():
 
         bug_issue_numbers = get_bug_issue_numbers(issues, bug_labels)
 
-        with result_file_path.open('w') as f:
-            json.dump(bug_issue_numbers, f, indent=4)
+        json_io.write(result_file_path, bug_issue_numbers)
 
         aggregated[target.name] = bug_issue_numbers
 
-    with aggregated_file_path.open('w') as f:
-        json.dump(aggregated, f, indent=4)
+    json_io.write(aggregated_file_path, aggregated)
 
 
 def get_token() -> str:
@@ -108,8 +105,7 @@ def get_bug_labels(repo_name: str) -> list:
     :return: バグに関連するラベル．
     """
     file_path = Path(f'../result/fetch_bug_labels/{repo_name}/{repo_name}.json')
-    with file_path.open() as f:
-        return json.load(f)
+    return json_io.read(file_path)
 
 
 def get_bug_issue_numbers(issues: list, bug_labels: list) -> list:
@@ -3,13 +3,13 @@ bug labels を GitHub Rest Api を用いて取得し，
 ユーザーにその一覧を表示させる．
 ユーザーが，ラベルを選択するとそれを結果に書き込むプログラム．
 """
-import json
 import os
 from pathlib import Path
 
 import requests
 from dotenv import load_dotenv
 
+import json_io
 from repo import Repo
 
 
@@ -35,21 +35,18 @@ def main():
         result_file_path = result_dir / target.name / f'{target.name}.json'
         result_file_path.parent.mkdir(exist_ok=True)
         if result_file_path.exists():
-            with result_file_path.open() as f:
-                aggregated[target.name] = json.load(f)
+            aggregated[target.name] = json_io.read(result_file_path)
             continue
 
         api_url = make_api_url(Repo(target))
         labels = fetch_labels(api_url, headers)
         bug_labels = decide_labels(labels)
 
-        with result_file_path.open('w') as f:
-            json.dump(bug_labels, f)
+        json_io.write(result_file_path, bug_labels)
 
         aggregated[target.name] = bug_labels
 
-    with aggregated_file_path.open('w') as f:
-        json.dump(aggregated, f, indent=4)
+    json_io.write(aggregated_file_path, aggregated)
 
 
 def get_token() -> str:
@@ -2,11 +2,11 @@
 バグに関する issue が閉じられるまでに変更のあったファイルパスを取得する．
 ただし，マージコミットの親が 3 つ以上の場合は何も取得しない．
 """
-import json
 from pathlib import Path
 
 from tqdm import tqdm
 
+import json_io
 from repo import Repo
 
 
@@ -29,8 +29,7 @@ def main():
         result_file_path = result_dir / target.name / f'{target.name}.json'
         result_file_path.parent.mkdir(exist_ok=True)
         if result_file_path.exists():
-            with result_file_path.open() as f:
-                aggregated[target.name] = json.load(f)
+            aggregated[target.name] = json_io.read(result_file_path)
             continue
 
         repo = Repo(target)
@@ -42,13 +41,11 @@ def main():
                 changed_files = get_changed_files(repo, merge_commit)
                 store_result(result, merge_commit, base_commit, changed_files)
 
-        with result_file_path.open('w') as f:
-            json.dump(result, f, indent=4)
+        json_io.write(result_file_path, result)
 
         aggregated[target.name] = result
 
-    with aggregated_file_path.open('w') as f:
-        json.dump(aggregated, f, indent=4)
+    json_io.write(aggregated_file_path, aggregated)
 
 
 def identify_merge_commits(repo_name: str) -> list:
@@ -75,8 +72,7 @@ def get_bug_issue_numbers(repo_name: str) -> list:
     """
     result_root = Path(f'../result/fetch_bug_issue_numbers')
     file_path = result_root / repo_name / f'{repo_name}.json'
-    with file_path.open() as f:
-        return json.load(f)
+    return json_io.read(file_path)
 
 
 def get_commit_messages(repo_name) -> dict:
@@ -86,8 +82,7 @@ def get_commit_messages(repo_name) -> dict:
     """
     result_root = Path(f'../result/get_commit_messages')
     file_path = result_root / repo_name / f'{repo_name}.json'
-    with file_path.open() as f:
-        return json.load(f)
+    return json_io.read(file_path)
 
 
 def get_changed_files(repo: Repo, merge_commit: str) -> list:
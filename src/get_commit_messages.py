@@ -1,11 +1,11 @@
 """
 解析対象のコミットハッシュを固定するために csv に記録する．
 """
-import json
 from pathlib import Path
 
 from tqdm import tqdm
 
+import json_io
 from global_var import deadline
 from repo import Repo
 
@@ -29,6 +29,4 @@ for repo_prefix in tqdm(target_list):
     result_dir.mkdir(exist_ok=True, parents=True)
     result_file_path = result_dir / f'{repo_name}.json'
 
-    with result_file_path.open('w') as f:
-        json.dump(commit_dict, f, indent=4)
-        f.write('\n')
+    json_io.write(result_file_path, commit_dict)
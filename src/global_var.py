@@ -7,3 +7,55 @@ from pathlib import Path
 deadline = datetime.strptime('2024-09-30 23:59:59', '%Y-%m-%d %H:%M:%S')
 
 runner_path = Path('./PyNose-ASE2021/runner.py').resolve(strict=True)
+
+# True ならば PyNose をサーバーとして常駐させ，コミットごとの起動を省く．
+use_pynose_server = False
+
+# True ならば PyNose の結果をコミットごとの json ファイルではなく，
+# リポジトリごとのセグメントファイルに圧縮してまとめる．
+use_segment_store = False
+
+# True ならば PyNose の実行直後にテストファイルごとのテストスメルの数を
+# ../result/compress_pynose_result に書き出し，compress_pynose_result.py を不要にする．
+fuse_compression = False
+
+# fuse_compression が True のときに元の結果をどうするか．'keep' ならば残し，'discard' ならば捨てる．
+raw_result_retention = 'keep'
+
+# True ならば .py ファイルのパスと blob がすべて解析済みのコミットと同じコミットは PyNose を実行せず，結果を使い回す．
+use_test_fingerprint = False
+
+# 1 つのリポジトリを並列に解析するワーカーの数．ワーカーごとに worktree と PyNose を持つ．
+pynose_worker_cnt = 1
+
+# schedule_pynose.py で全リポジトリを解析するワーカーの数．
+pynose_scheduler_worker_cnt = 4
+
+# smell_delta.py で圧縮した結果をまとめるときに，この数のコミットごとに全ファイルの結果を書く．
+# 間のコミットは直前のコミットから変わったファイルの結果だけを書く．
+smell_delta_keyframe_interval = 100
+
+# True ならば圧縮するときにテストケースごとのテストスメルのビット列も ../result/smell_bitset に書き出す．
+write_smell_bitsets = False
+
+# True ならば mapping_test_to_prod.py で直前のコミットの対応付けを引き継ぎ，変わったテストファイルだけを対応付け直す．
+use_incremental_mapping = False
+
+# True ならば mapping_test_to_prod.py でファイルごとのインポートの一覧を blob のハッシュで保存し，同じ中身のファイルを解析し直さない．
+use_import_cache = False
+
+# True ならば mapping_test_to_prod.py でインポートを正規表現で抜き出し，
+# unittest をインポートしているファイルと判断できないファイルだけ ast 解析する．
+use_import_scanner = False
+
+# mapping_test_to_prod.py で対応付けを行うプロセスの数．1 ならば並列化せずに順に処理する．
+mapping_worker_cnt = 1
+
+# mapping_worker_cnt が 2 以上のときに，1 つのジョブにまとめる連続したコミットの数．
+mapping_chunk_size = 500
+
+# 結果のファイルを書き出すときの fsync の仕方．
+# 'each' ならばファイルごとに置き換える前に fsync する．
+# 'batch' ならば AtomicWriter が commit でまとめて fsync し，atomic_write は置き換えだけを行う．
+# 'none' ならば fsync しない．いずれの場合も書きかけのファイルは出力先に現れない．
+atomic_fsync = 'batch'
@@ -0,0 +1,130 @@
+"""
+テストファイルがインポートしているモジュールを blob のハッシュで引けるように保存するモジュール．
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+import json_io
+
+
+class ImportCache:
+    """
+    ファイルから抽出したインポートの一覧を，ファイルの blob のハッシュをキーとして
+    .git 内の SQLite に保存するクラス．
+    中身が同じファイルはコミットや実行をまたいでも 1 度しか解析しない．
+    解析できなかったファイルは NULL として保存する．
+
+    件数が max_entries を超えたら，最後に使われたのが古いものから削除する．
+    使われた記録と追加したものは参照や追加のたびに書き込まず，
+    touch_batch_size 件ごとにまとめて 1 度のコミットで書き込む．
+    複数のプロセスで同じキャッシュを共有しても，書き込みのロックを取り合う回数が少なくて済む．
+    """
+    file_name = 'import_cache.sqlite3'
+    max_entries = 1_000_000
+    touch_batch_size = 1000
+
+    def __init__(self, git_dir: Path):
+        """
+        :param git_dir: .git ディレクトリへのパス．キャッシュはここに保存する．
+        """
+        self._conn = sqlite3.connect(git_dir / self.file_name, timeout=60,
+                                     check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS imports ('
+                           'blob TEXT PRIMARY KEY, '
+                           'modules TEXT, '
+                           'last_used INTEGER NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS imports_last_used '
+                           'ON imports (last_used)')
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._clock = self._conn.execute(
+            'SELECT COALESCE(MAX(last_used), 0) FROM imports').fetchone()[0]
+        self._touched: dict[str, int] = {}
+        self._puts: dict[str, Optional[str]] = {}
+
+    def get(self, object_id: str) -> Optional[list[str]]:
+        """
+        キャッシュされているインポートの一覧を引く．
+        :param object_id: blob のオブジェクト ID．
+        :return: インポートしているモジュール．解析できなかったファイルは None．
+        :raise KeyError: キャッシュにない．
+        """
+        with self._lock:
+            self._clock += 1
+            # まだ書き込んでいないものは書き込むときに使われたことになる
+            if object_id in self._puts:
+                value = self._puts[object_id]
+            else:
+                row = self._conn.execute(
+                    'SELECT modules FROM imports WHERE blob = ?',
+                    (object_id,)).fetchone()
+                if row is None:
+                    raise KeyError(object_id)
+                value = row[0]
+                self._touched[object_id] = self._clock
+                if len(self._touched) >= self.touch_batch_size:
+                    self._flush_touched()
+        return None if value is None else json_io.loads(value)
+
+    def put(self, object_id: str, modules: Optional[list[str]]) -> None:
+        """
+        インポートの一覧を保存する．
+        :param object_id: blob のオブジェクト ID．
+        :param modules: インポートしているモジュール．解析できなかったファイルは None．
+        """
+        value = None if modules is None \
+            else json_io.dumps(modules).decode('utf-8')
+        with self._lock:
+            self._puts[object_id] = value
+            if len(self._puts) >= self.touch_batch_size:
+                self._flush_puts()
+                self._evict()
+
+    def flush(self) -> None:
+        """
+        追加したものと使われた記録を書き込み，上限を超えた分を削除する．
+        """
+        with self._lock:
+            self._flush_puts()
+            self._flush_touched()
+            self._evict()
+
+    def close(self) -> None:
+        """
+        追加したものと使われた記録を書き込んでデータベースを閉じる．
+        """
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def _flush_puts(self) -> None:
+        if not self._puts:
+            return
+        self._clock += 1
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO imports VALUES (?, ?, ?)',
+            [(object_id, value, self._clock)
+             for object_id, value in self._puts.items()])
+        self._conn.commit()
+        self._puts.clear()
+
+    def _flush_touched(self) -> None:
+        self._conn.executemany(
+            'UPDATE imports SET last_used = MAX(last_used, ?) WHERE blob = ?',
+            [(clock, object_id) for object_id, clock in self._touched.items()])
+        self._conn.commit()
+        self._touched.clear()
+
+    def _evict(self) -> None:
+        entry_cnt = self._conn.execute(
+            'SELECT COUNT(*) FROM imports').fetchone()[0]
+        if entry_cnt <= self.max_entries:
+            return
+        # 毎回削除しなくて済むように上限の 1 割ほど余分に空ける
+        excess = entry_cnt - self.max_entries * 9 // 10
+        self._conn.execute(
+            'DELETE FROM imports WHERE blob IN ('
+            'SELECT blob FROM imports ORDER BY last_used LIMIT ?)', (excess,))
+        self._conn.commit()
@@ -0,0 +1,95 @@
+"""
+各ステージで json を読み書きする python API を提供するモジュール．
+orjson か msgspec があればそれを使い，なければ標準ライブラリを使う．
+結果は機械しか読まないので，既定ではインデントせずに書き出す．
+どの実装でも UTF-8 のバイト列を直接読み書きし，str への変換を挟まない．
+"""
+import json
+from pathlib import Path
+from typing import IO, Any, Optional, Union
+
+from atomic_io import AtomicWriter, open_atomic
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    backend = 'orjson'
+    # orjson.JSONDecodeError は json.JSONDecodeError を継承している
+    DecodeError = json.JSONDecodeError
+elif msgspec is not None:
+    backend = 'msgspec'
+    DecodeError = (json.JSONDecodeError, msgspec.DecodeError)
+else:
+    backend = 'json'
+    DecodeError = json.JSONDecodeError
+
+
+def dumps(obj: Any, pretty: bool = False) -> bytes:
+    """
+    UTF-8 の json にする．
+    :param obj: 書き出すオブジェクト．
+    :param pretty: True ならば人が読めるようにインデントする．
+    """
+    if backend == 'orjson':
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if backend == 'msgspec':
+        data = msgspec.json.encode(obj)
+        return msgspec.json.format(data, indent=2) if pretty else data
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False,
+                      separators=(',', ':')).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """
+    json を読み込む．
+    :param data: UTF-8 のバイト列もしくは文字列．
+    :raise DecodeError: json として読み込めない．
+    """
+    if backend == 'orjson':
+        return orjson.loads(data)
+    if backend == 'msgspec':
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def load(f: IO[bytes]) -> Any:
+    """
+    バイナリモードで開いたファイルから json を読み込む．
+    """
+    return loads(f.read())
+
+
+def read(path: Path) -> Any:
+    """
+    json ファイルを読み込む．
+    :param path: ファイルパス．
+    :raise DecodeError: json として読み込めない．
+    """
+    return loads(path.read_bytes())
+
+
+def write(path: Path, obj: Any, pretty: bool = False,
+          writer: Optional[AtomicWriter] = None) -> None:
+    """
+    json ファイルを原子的に書き出す．
+    :param path: 出力先．
+    :param obj: 書き出すオブジェクト．
+    :param pretty: True ならば人が読めるようにインデントする．
+    :param writer: 与えられた場合は，出力をこれに任せてまとめて確定させる．
+    """
+    data = dumps(obj, pretty)
+    with open_atomic(path, 'wb', writer=writer) as f:
+        f.write(data)
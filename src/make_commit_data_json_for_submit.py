@@ -5,11 +5,12 @@
 ２．マージコミットと判断したコミットハッシュ．
 ３．２ で判断したコミットのベースコミットハッシュ．
 """
-import json
 from pathlib import Path
 
 from tqdm import tqdm
 
+import json_io
+
 
 def main():
     """
@@ -38,21 +39,18 @@ def main():
             else:
                 result[prod_path] = {'latest_commit_hash': latest_commit_hash}
 
-        with result_file_path.open('w') as f:
-            json.dump(result, f, indent=4)
+        json_io.write(result_file_path, result, pretty=True)
 
         aggregated[url] = result
 
-    with aggregated_file_path.open('w') as f:
-        json.dump(aggregated, f, indent=4)
+    json_io.write(aggregated_file_path, aggregated, pretty=True)
 
 
 def load_data_forged_json() -> dict:
     """
     data_forge.py のデータを読み込む．
     """
-    with Path('../result/data_forge/aggregated.json').open() as f:
-        return json.load(f)
+    return json_io.read(Path('../result/data_forge/aggregated.json'))
 
 
 def get_merge_and_base_commit_hash(repo_name: str, prod_path: str) -> tuple:
@@ -61,8 +59,7 @@ def get_merge_and_base_commit_hash(repo_name: str, prod_path: str) -> tuple:
     """
     result_root = Path('../result/get_changed_files_before_merge')
     file_path = result_root / repo_name / f'{repo_name}.json'
-    with file_path.open() as f:
-        bug_fix_data_list = json.load(f)
+    bug_fix_data_list = json_io.read(file_path)
 
     merge_commit = None
     base_commit = None
@@ -81,8 +78,7 @@ def get_latest_commit_hash(url: str) -> tuple[str, str]:
     """
     repo_name = get_repo_name(url)
     file_path = Path(f'../result/dump_commit_hash/{repo_name}.json')
-    with file_path.open() as f:
-        commit_hashes = json.load(f)
+    commit_hashes = json_io.read(file_path)
     return file_path.stem, commit_hashes[-1]
 
 
@@ -1,12 +1,13 @@
 """
 mapping_test_to_prod.py で得られた結果を反転する．
 """
-import json
 from collections import defaultdict
 from pathlib import Path
 
 from tqdm import tqdm
 
+import json_io
+
 
 def main():
     """
@@ -22,14 +23,12 @@ def main():
         if output_file.exists():
             continue
 
-        with input_file.open() as f:
-            orig_dict = json.load(f)
+        orig_dict = json_io.read(input_file)
 
         inverted_dict = invert(orig_dict)
 
         output_file.parent.mkdir(exist_ok=True, parents=True)
-        with output_file.open('w', encoding='utf-8') as f:
-            json.dump(inverted_dict, f, indent=4)
+        json_io.write(output_file, inverted_dict)
 
 
 def invert(dict_obj: dict) -> dict:
@@ -4,15 +4,32 @@ unittest を読み込んでいる .py ファイルを読み込み，製品コー
 候補が 2 以上存在する場合は断定できないため対応付けをしない．
 """
 import ast
-import json
+import posixpath
+import re
 import sys
 from ast import NodeVisitor
-from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator, NamedTuple, Optional
 
 from tqdm import tqdm
 
+from atomic_io import AtomicWriter
+import json_io
+from object_reader import ObjectReader, TreeEntry
 from repo import Repo
-from global_var import deadline
+from result_store import result_file_name
+from global_var import (deadline, mapping_chunk_size, mapping_worker_cnt,
+                        use_import_cache, use_import_scanner,
+                        use_incremental_mapping)
+
+# たどるシンボリックリンクの数の上限．Linux の MAXSYMLINKS と同じ．
+max_symlink_depth = 40
+
+# 対応付けの結果をまとめて確定させるコミットの数．
+commit_interval = 100
 
 
 def main():
@@ -42,7 +59,12 @@ def main():
 def mapping_per_repo(result_root: Path, repo_list: list[Repo]):
     """
     リポジトリごとに対応付けを行う．
+    mapping_worker_cnt が 2 以上ならば，コミットをまとめたジョブをプロセスに振り分ける．
     """
+    if mapping_worker_cnt > 1:
+        mapping_in_parallel(result_root, repo_list, mapping_worker_cnt,
+                            mapping_chunk_size)
+        return
     for repo in tqdm(repo_list):
         result_dir = result_root / repo.name
         mapping_per_commit(repo, result_dir)
@@ -55,57 +77,145 @@ def mapping_per_commit(repo: Repo, result_dir: Path):
     :param result_dir: 結果を格納するディレクトリ．
     """
     result_dir.mkdir(exist_ok=True)
+    commits = list_pending_commits(repo, result_dir)
+    map_commits(repo, result_dir, tqdm(commits, leave=False))
+
+
+def mapping_in_parallel(result_root: Path, repo_list: list[Repo],
+                        worker_cnt: int, chunk_size: int):
+    """
+    まだ結果のないコミットをリポジトリごとに chunk_size 個ずつ連続した範囲にまとめ，
+    プロセスプールで対応付けを行う．
+    ファイルはオブジェクトデータベースから読むので，ワーカー同士がチェックアウトを取り合うことはない．
+    ジョブごとに IncrementalMapper を持つため，範囲の先頭のコミットだけはすべてのファイルを対応付ける．
+    :param result_root: リポジトリごとの結果のディレクトリを格納するディレクトリ．
+    :param repo_list: 対象のリポジトリ．
+    :param worker_cnt: プロセスの数．
+    :param chunk_size: 1 つのジョブに含めるコミットの数．
+    """
+    jobs = []
+    for repo in tqdm(repo_list, desc='planning'):
+        result_dir = result_root / repo.name
+        result_dir.mkdir(exist_ok=True)
+        commits = list_pending_commits(repo, result_dir)
+        for start in range(0, len(commits), chunk_size):
+            jobs.append((repo.repo_path, result_dir,
+                         commits[start:start + chunk_size]))
+
+    with ProcessPoolExecutor(worker_cnt) as executor, \
+            tqdm(total=sum(len(job[2]) for job in jobs)) as pbar:
+        futures = {executor.submit(map_commit_range, *job): len(job[2])
+                   for job in jobs}
+        for future in as_completed(futures):
+            future.result()
+            pbar.update(futures[future])
+
+
+def map_commit_range(repo_path: Path, result_dir: Path,
+                     commits: list[tuple[int, str]]) -> int:
+    """
+    プロセスプールのジョブとして，連続したコミットの対応付けを行う．
+    :param repo_path: リポジトリのパス．
+    :param result_dir: 結果を格納するディレクトリ．
+    :param commits: コミットの順番とコミットハッシュの組．順番の昇順に並ぶ．
+    :return: 対応付けたコミットの数．
+    """
+    sys.setrecursionlimit(10000)  # ast 解析中の再帰制限対策
+    return map_commits(open_repo(repo_path), result_dir, commits)
+
+
+@lru_cache(maxsize=None)
+def open_repo(repo_path: Path) -> Repo:
+    """
+    リポジトリを開く．プロセスごとに 1 度だけ開き，git cat-file を使い回す．
+    """
+    return Repo(repo_path)
+
+
+def list_pending_commits(repo: Repo,
+                         result_dir: Path) -> list[tuple[int, str]]:
+    """
+    結果がまだ存在しないコミットを返す．
+    :return: コミットの順番とコミットハッシュの組．順番の昇順に並ぶ．
+    """
     commit_hashes = repo.get_commit_hashes(until=deadline)
-    for i, commit_hash in enumerate(tqdm(commit_hashes, leave=False), start=1):
-        result_file = f'{repo.name}_{i:06d}_{commit_hash}.json'
-        result_path = result_dir / result_file
-        if result_path.exists():
-            continue
-        repo.checkout(commit_hash)
-        result = mapping_per_file(repo)
-        with result_path.open('w', encoding='utf-8') as f:
-            json.dump(result, f, indent=4)
+    return [(i, commit_hash)
+            for i, commit_hash in enumerate(commit_hashes, start=1)
+            if not (result_dir
+                    / result_file_name(repo.name, i, commit_hash)).exists()]
+
+
+def map_commits(repo: Repo, result_dir: Path,
+                commits: Iterable[tuple[int, str]]) -> int:
+    """
+    与えられたコミットを順に対応付け，コミットごとに結果を書き出す．
+    :param repo: リポジトリを操作するクラス．
+    :param result_dir: 結果を格納するディレクトリ．
+    :param commits: コミットの順番とコミットハッシュの組．
+    :return: 対応付けたコミットの数．
+    """
+    mapper = IncrementalMapper(repo) if use_incremental_mapping else None
+    mapped_cnt = 0
+    # 結果はまとめてディスクに書き込み，中断しても確定させた分は失われない
+    with AtomicWriter() as writer:
+        for i, commit_hash in commits:
+            result_path = result_dir / result_file_name(repo.name, i,
+                                                        commit_hash)
+            if result_path.exists():
+                continue
+            tree = repo.list_tree(commit_hash)
+            if mapper is None:
+                result = mapping_per_file(repo, tree)
+            else:
+                result = mapper.map(tree)
+            json_io.write(result_path, result, writer=writer)
+            mapped_cnt += 1
+            if mapped_cnt % commit_interval == 0:
+                writer.commit()
+    if use_import_cache:
+        repo.import_cache.flush()
+    return mapped_cnt
 
 
-def mapping_per_file(repo: Repo) -> dict:
+def mapping_per_file(repo: Repo, tree: list[TreeEntry]) -> dict:
     """
     ファイルごとに対応付けを行う．
+    ファイルはチェックアウトせずにオブジェクトデータベースから読み込む．
     :param repo: リポジトリを操作するクラス．
+    :param tree: 対象のコミットに含まれるファイルの一覧．
     """
     result = {}
-    python_files = repo.repo_path.rglob('*.py')
-    test_files = [file for file in python_files if 'test' in file.stem]
+    python_files = [entry for entry in tree if entry.path.endswith('.py')]
+    path_index = PathIndex(entry.path for entry in python_files)
+    test_files = [entry for entry in python_files
+                  if 'test' in PurePosixPath(entry.path).stem]
+    tree_entries = {entry.path: entry for entry in tree}
     for test_file in tqdm(test_files, leave=False):
-        files = mapping(repo, test_file)
+        target = resolve_symlink(repo, test_file, tree_entries)
+        if target is None:
+            continue
+        files = mapping(repo, target, path_index)
         if files:
-            result[test_file.relative_to(repo.repo_path).as_posix()] = files
+            result[test_file.path] = files
     return result
 
 
-def mapping(repo: Repo, python_file: Path):
+def mapping(repo: Repo, python_file: TreeEntry, path_index: 'PathIndex',
+            queried: Optional[set] = None):
     """
     python_file が unittest を インポートしていればテストファイルとみなす．
     python_file がインポートしているファイルをパスから特定する．
     候補が 2 つから絞れない場合は見つからなかったことにする．
-    :param repo: リポジトリを操作するクラス．検索用．
-    :param python_file: マッピング対象のファイル．
+    :param repo: リポジトリを操作するクラス．読み込み用．
+    :param python_file: マッピング対象のファイル．シンボリックリンクは resolve_symlink でたどっておく．
+    :param path_index: 同じコミットに含まれる .py ファイルのパスの索引．検索用．
+    :param queried: 与えられた場合は，索引で探したパスを追加する．
     """
-    try:
-        modules = get_imports(python_file)
-    except SyntaxError:
-        return None
-    except UnicodeDecodeError:
-        return None
-    except FileNotFoundError:  # シンボリックリンクの可能性がある．
-        return None
-    except IsADirectoryError:  # .pyがついたディレクトリの可能性がある．
-        return None
-    except ValueError:  # null byte が含まれている可能性がある．
-        return None
-    except OSError:  # シンボリックが循環もしくは深すぎる可能性がある．
+    if python_file.mode == ObjectReader.symlink_mode:
         return None
 
-    if not import_unittest(modules):
+    modules = read_imports(repo, python_file.object_id)
+    if modules is None or not import_unittest(modules):
         return None
 
     result = []
@@ -113,11 +223,13 @@ def mapping(repo: Repo, python_file: Path):
         module_like_path = Path(module.replace('.', '/')).with_suffix('.py')
 
         while True:
-            hits = list(repo.repo_path.rglob(module_like_path.as_posix()))
+            pattern = module_like_path.as_posix()
+            if queried is not None:
+                queried.add(pattern)
+            hits = path_index.find(pattern)
             if hits:
                 if len(hits) == 1:
-                    hit_path = hits[0].relative_to(repo.repo_path).as_posix()
-                    result.append(hit_path)
+                    result.append(hits[0])
                 break
             elif module_like_path.parent.as_posix() == '.':
                 break
@@ -127,13 +239,198 @@ def mapping(repo: Repo, python_file: Path):
     return result
 
 
-def get_imports(file: Path) -> list[str]:
+def resolve_symlink(repo: Repo, entry: TreeEntry,
+                    tree_entries: dict[str, TreeEntry]) -> Optional[TreeEntry]:
     """
-    ast 解析でインポートしているモジュールを抽出する．
+    シンボリックリンクをたどり，チェックアウトしたファイルを開いた場合と同じファイルを返す．
+    リンク先がコミットの外にあるもの，存在しないもの，循環しているものは開けなかったものとして None を返す．
+    :param repo: リポジトリを操作するクラス．読み込み用．
+    :param entry: たどるファイル．シンボリックリンクでなければそのまま返す．
+    :param tree_entries: 同じコミットに含まれるファイルのパスとファイルの辞書．
+    """
+    for _ in range(max_symlink_depth):
+        if entry.mode != ObjectReader.symlink_mode:
+            return entry
+        link = repo.object_reader.read(entry.object_id)
+        if link is None:
+            return None
+        target = link.decode('utf-8', 'surrogateescape')
+        if posixpath.isabs(target):
+            return None
+        path = posixpath.normpath(
+            posixpath.join(posixpath.dirname(entry.path), target))
+        if path == '..' or path.startswith('../'):
+            return None
+        entry = tree_entries.get(path)
+        if entry is None:
+            return None
+    return None
+
+
+def read_imports(repo: Repo, object_id: str) -> Optional[list[str]]:
+    """
+    ファイルがインポートしているモジュールを返す．
+    use_import_cache が True ならば blob ごとにキャッシュし，同じ中身のファイルは 1 度しか解析しない．
+    :param repo: リポジトリを操作するクラス．読み込み用．
+    :param object_id: ファイルの blob のオブジェクト ID．
+    use_import_scanner が True ならば，unittest をインポートしていないファイルは構文を確かめないため，
+    構文エラーのファイルでも None ではなくインポートの一覧を返すことがある．どちらも対応付けの対象外となる．
+    :return: インポートしているモジュール．解析できなかった場合は None．
+    """
+    if use_import_cache:
+        try:
+            return repo.import_cache.get(object_id)
+        except KeyError:
+            pass
+
+    try:
+        contents = repo.object_reader.read_text(object_id)
+        modules = scan_imports(contents) if use_import_scanner else None
+        # unittest をインポートしていれば，構文が正しいかも含めて ast 解析で確かめる
+        if modules is None or import_unittest(modules):
+            modules = get_imports(contents)
+    except SyntaxError:
+        modules = None
+    except UnicodeDecodeError:
+        modules = None
+    except ValueError:  # null byte が含まれている可能性がある．
+        modules = None
+
+    if use_import_cache:
+        repo.import_cache.put(object_id, modules)
+    return modules
+
+
+class PathIndex:
+    """
+    コミットに含まれる .py ファイルのパスを，末尾の要素の並びごとに引けるようにするクラス．
+    a/b/c.py は c.py，b/c.py，a/b/c.py のそれぞれで引ける．
+    rglob と同様に末尾が一致するパスを，走査せずに辞書の参照だけで探せる．
+    """
+
+    def __init__(self, python_paths: Iterable[str]):
+        """
+        :param python_paths: / 区切りのパス．
+        """
+        self._paths: dict[str, list[str]] = defaultdict(list)
+        for path in python_paths:
+            self.add(path)
+
+    def add(self, path: str) -> None:
+        """
+        パスを索引に加える．
+        """
+        for suffix in iter_suffixes(path):
+            self._paths[suffix].append(path)
+
+    def remove(self, path: str) -> None:
+        """
+        パスを索引から取り除く．
+        """
+        for suffix in iter_suffixes(path):
+            paths = self._paths[suffix]
+            paths.remove(path)
+            if not paths:
+                del self._paths[suffix]
+
+    def find(self, pattern: str) -> list[str]:
+        """
+        末尾が pattern と一致するパスを探す．
+        :param pattern: a/b.py のような / 区切りのパス．
+        """
+        return self._paths.get(pattern, [])
+
+
+class Resolution(NamedTuple):
+    """
+    1 つのテストファイルの対応付けの結果と，その結果を左右するパス．
+    """
+    key: tuple[str, str, Optional[str]]
+    files: Optional[list[str]]
+    queried: frozenset
+
+
+class IncrementalMapper:
+    """
+    直前に対応付けたコミットの結果を引き継ぎ，変わった部分だけを対応付け直すクラス．
+    対応付け直すのは，中身が変わったテストファイルと，
+    探したパスに一致する .py ファイルが追加もしくは削除されたテストファイルである．
+    結果は mapping_per_file と同じになる．
+    """
+
+    def __init__(self, repo: Repo):
+        """
+        :param repo: リポジトリを操作するクラス．
+        """
+        self.repo = repo
+        self._path_index = PathIndex([])
+        self._paths: set[str] = set()
+        self._resolutions: dict[str, Resolution] = {}
+
+    def map(self, tree: list[TreeEntry]) -> dict:
+        """
+        コミットのファイルを対応付ける．
+        :param tree: 対象のコミットに含まれるファイルの一覧．
+        """
+        python_files = [entry for entry in tree if entry.path.endswith('.py')]
+        paths = {entry.path for entry in python_files}
+        added = paths - self._paths
+        removed = self._paths - paths
+        for path in removed:
+            self._path_index.remove(path)
+        for path in added:
+            self._path_index.add(path)
+        self._paths = paths
+        changed_suffixes = {suffix for path in added | removed
+                            for suffix in iter_suffixes(path)}
+
+        result = {}
+        resolutions = {}
+        tree_entries = None
+        for entry in python_files:
+            if 'test' not in PurePosixPath(entry.path).stem:
+                continue
+            target = entry
+            if entry.mode == ObjectReader.symlink_mode:
+                # シンボリックリンクはリンク先の中身が変わった場合も対応付け直す
+                if tree_entries is None:
+                    tree_entries = {tree_entry.path: tree_entry
+                                    for tree_entry in tree}
+                target = resolve_symlink(self.repo, entry, tree_entries)
+            key = (entry.object_id, entry.mode,
+                   None if target is None else target.object_id)
+            resolution = self._resolutions.get(entry.path)
+            if resolution is None or resolution.key != key \
+                    or not resolution.queried.isdisjoint(changed_suffixes):
+                queried = set()
+                files = None if target is None \
+                    else mapping(self.repo, target, self._path_index, queried)
+                resolution = Resolution(key, files, frozenset(queried))
+            resolutions[entry.path] = resolution
+            if resolution.files:
+                result[entry.path] = resolution.files
+        self._resolutions = resolutions
+        return result
+
+
+def iter_suffixes(path: str) -> Iterator[str]:
+    """
+    パスの末尾の要素の並びを短いものから順に返す．
+    :param path: / 区切りのパス．
     """
-    with file.open(encoding='utf-8') as f:
-        contents = f.read()
+    start = len(path)
+    while start > 0:
+        start = path.rfind('/', 0, start)
+        yield path[start + 1:]
+        if start < 0:
+            return
+
 
+def get_imports(contents: str) -> list[str]:
+    """
+    ast 解析でインポートしているモジュールを抽出する．
+    :param contents: ソースコード．
+    """
     class ImportVisitor(NodeVisitor):
         """
         コード内の import, from import 文を集めるクラス．
@@ -166,6 +463,84 @@ def get_imports(file: Path) -> list[str]:
     return modules
 
 
+_NAME = r'[^\W\d]\w*'
+_DOTTED = rf'{_NAME}(?:[ \t\f]*\.[ \t\f]*{_NAME})*'
+_ALIAS = rf'{_NAME}(?:\s+as\s+{_NAME})?'
+_DOTTED_ALIAS = rf'{_DOTTED}(?:\s+as\s+{_NAME})?'
+_TRAILER = r'[ \t\f]*(?:#[^\n]*)?'
+
+# 文字列とコメントを読み飛ばしながら，行頭の import 文と from import 文を探す．
+# 行頭以外の import は 1 行に複数の文が書かれている可能性があるため，解析を ast に任せる．
+_LEXER = re.compile(r'''
+    (?P<statement>^[ \t\f]*(?:from|import)\b[^\n(]*(?:\([^)]*\)[^\n]*)?)
+  | \#[^\n]*
+  | """(?:[^"\\]|\\[\s\S]|"(?!""))*"""
+  | \'\'\'(?:[^'\\]|\\[\s\S]|'(?!\'\'))*\'\'\'
+  | "(?:[^"\\\n]|\\[\s\S])*"
+  | '(?:[^'\\\n]|\\[\s\S])*'
+  | (?P<ambiguous>["']|\bimport\b)
+''', re.MULTILINE | re.VERBOSE)
+
+_IMPORT = re.compile(
+    rf'[ \t\f]*import[ \t\f]+(?P<names>{_DOTTED_ALIAS}(?:[ \t\f]*,[ \t\f]*{_DOTTED_ALIAS})*)'
+    rf'{_TRAILER}')
+
+_FROM_IMPORT = re.compile(
+    rf'[ \t\f]*from(?=[ \t\f.])[ \t\f]*(?P<dots>(?:\.[ \t\f]*)*)(?P<module>{_DOTTED})?'
+    rf'[ \t\f]*import(?P<names>[ \t\f]*\*'
+    rf'|[ \t\f]*\(\s*{_ALIAS}(?:\s*,\s*{_ALIAS})*\s*,?\s*\)'
+    rf'|[ \t\f]+{_ALIAS}(?:[ \t\f]*,[ \t\f]*{_ALIAS})*)'
+    rf'{_TRAILER}')
+
+_ALIAS_NAME = re.compile(rf'\*|({_DOTTED})(?:\s+as\s+{_NAME})?')
+_SPACE = re.compile(r'\s+')
+
+
+def scan_imports(contents: str) -> Optional[list[str]]:
+    """
+    ast 解析をせずに，正規表現でインポートしているモジュールを抽出する．
+    構文の正しいファイルであれば get_imports と同じ結果を返す．構文が正しいかは確かめない．
+    行の途中の import，バックスラッシュでの継続行，括弧内のコメントなど，
+    正規表現で確実に読み取れない書き方を見つけた場合は None を返す．
+    :param contents: ソースコード．
+    :return: インポートしているモジュール．判断できない場合は None．
+    """
+    if 'import' not in contents:
+        return []
+
+    modules = []
+    for match in _LEXER.finditer(contents):
+        if match['ambiguous'] is not None:
+            return None
+        statement = match['statement']
+        if statement is None:
+            continue
+
+        import_match = _IMPORT.fullmatch(statement)
+        if import_match is not None:
+            for alias in _ALIAS_NAME.finditer(import_match['names']):
+                modules.append(_SPACE.sub('', alias[1]))
+            continue
+
+        from_match = _FROM_IMPORT.fullmatch(statement)
+        if from_match is None:
+            return None
+        module = from_match['module']
+        if module is None and not from_match['dots']:
+            return None
+        if module is not None:
+            module = _SPACE.sub('', module)
+        for alias in _ALIAS_NAME.finditer(from_match['names']):
+            name = alias[0] if alias[1] is None else alias[1]
+            if module is None:
+                modules.append(name)
+            elif name == '*':
+                modules.append(module)
+            else:
+                modules.append(module + '.' + name)
+    return modules
+
+
 def import_unittest(modules) -> bool:
     """
     unittest を import しているかを確認する．
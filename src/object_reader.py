@@ -0,0 +1,111 @@
+"""
+チェックアウトせずに任意のコミットのファイルを読むための python API を提供するモジュール．
+"""
+import io
+import subprocess
+import threading
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+
+class TreeEntry(NamedTuple):
+    """
+    ls-tree の 1 行分．
+    """
+    path: str
+    mode: str
+    object_id: str
+
+
+class ObjectReader:
+    """
+    常駐させた git cat-file --batch からオブジェクトを読み込むクラス．
+    ワーキングツリーに触れないので，同じリポジトリを並列に読める．
+    """
+    symlink_mode = '120000'
+
+    def __init__(self, repo_path: Path):
+        """
+        :param repo_path: リポジトリへのパス．
+        """
+        self.repo_path = repo_path
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def read(self, name: str) -> Optional[bytes]:
+        """
+        オブジェクトの中身を読み込む．
+        :param name: オブジェクト ID もしくは <コミット>:<パス> の形式の名前．
+        :return: オブジェクトの中身．存在しない場合は None．
+        """
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            self._process.stdin.write(name.encode('utf-8', 'surrogateescape')
+                                     + b'\n')
+            self._process.stdin.flush()
+
+            header = self._process.stdout.readline()
+            if not header or header.endswith(b' missing\n') \
+                    or header.endswith(b' ambiguous\n'):
+                return None
+            size = int(header.split()[2])
+            contents = self._process.stdout.read(size)
+            self._process.stdout.read(1)  # 末尾の改行
+        return contents
+
+    def read_text(self, name: str, encoding: str = 'utf-8') -> Optional[str]:
+        """
+        オブジェクトをテキストとして読み込む．
+        open() と同じくユニバーサル改行モードで変換する．
+        :param name: オブジェクト ID もしくは <コミット>:<パス> の形式の名前．
+        :param encoding: 文字コード．
+        :return: 文字列．存在しない場合は None．
+        """
+        contents = self.read(name)
+        if contents is None:
+            return None
+        with io.TextIOWrapper(io.BytesIO(contents), encoding=encoding) as f:
+            return f.read()
+
+    def list_tree(self, commit_hash: str) -> list[TreeEntry]:
+        """
+        コミットに含まれるファイルを列挙する．サブモジュールは含まない．
+        :param commit_hash: コミットハッシュ．
+        :return: リポジトリのルートからの相対パスとオブジェクト ID のリスト．
+        """
+        cmd = ['git', '-C', str(self.repo_path), 'ls-tree', '-r', '-z',
+               '--full-tree', commit_hash]
+        output = subprocess.run(cmd, check=True, capture_output=True).stdout
+        entries = []
+        for line in output.split(b'\0'):
+            if not line:
+                continue
+            info, path = line.split(b'\t', 1)
+            mode, object_type, object_id = info.decode().split()
+            if object_type == 'blob':
+                entries.append(TreeEntry(path.decode('utf-8', 'surrogateescape'),
+                                         mode, object_id))
+        return entries
+
+    def close(self) -> None:
+        """
+        cat-file を終了させる．
+        """
+        with self._lock:
+            if self._process is None:
+                return
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+
+    def _start(self) -> None:
+        cmd = ['git', '-C', str(self.repo_path), 'cat-file', '--batch']
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE)
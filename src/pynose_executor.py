@@ -1,9 +1,18 @@
 """
 PyNose の Python API を提供するモジュール．
 """
+import os
+import signal
+import socket
 import subprocess
+import threading
+import time
+from collections import deque
 from pathlib import Path
 from subprocess import run
+from typing import Optional
+
+import json_io
 
 
 class PyNoseExecutor:
@@ -51,3 +60,248 @@ class PyNoseExecutor:
         except subprocess.TimeoutExpired:
             print('Time out')
             raise TimeoutError
+
+    def close(self) -> None:
+        """
+        PyNoseServerExecutor と同じように扱えるように用意している．
+        実行ごとに PyNose が終了するので何もしない．
+        """
+
+
+class TimeoutPolicy:
+    """
+    リポジトリごとに過去の PyNose の実行時間を学習し，タイムアウトを決めるクラス．
+    実行時間は起動にかかる時間とテストファイルの数に比例する時間の和とみなし，
+    成功した実行のテストファイル 1 つあたりの時間の分布の上位から見積もる．
+    試行ごとに，どのように終わったかを JSON Lines で追記する．
+    """
+    min_samples = 10
+    max_samples = 1000
+    quantile = 0.95
+    margin = 2.0
+    min_timeout = 60
+    max_timeout = 3600
+    retry_factor = 3
+
+    def __init__(self, history_path: Path, default_timeout: float = 300):
+        """
+        :param history_path: 試行の記録を追記するファイルのパス．
+        :param default_timeout: 記録が少ないうちに使うタイムアウト．
+        """
+        self.history_path = history_path
+        self.default_timeout = default_timeout
+        self._samples = deque(maxlen=self.max_samples)
+        self._lock = threading.Lock()
+        if history_path.exists():
+            with history_path.open('rb') as f:
+                for line in f:
+                    try:
+                        attempt = json_io.loads(line)
+                    except json_io.DecodeError:
+                        continue  # 書き込み中に中断された行
+                    if attempt['outcome'] == 'ok':
+                        self._samples.append((attempt['elapsed'],
+                                              attempt['test_file_cnt']))
+
+    def timeout(self, test_file_cnt: int, attempt: int = 0) -> float:
+        """
+        タイムアウトを見積もる．再試行ではタイムアウトを延ばす．
+        :param test_file_cnt: 解析するテストファイルの数．
+        :param attempt: 何度目の試行か．0 から始まる．
+        :return: タイムアウト（秒）．
+        """
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < self.min_samples:
+            timeout = self.default_timeout
+        else:
+            overhead = min(elapsed for elapsed, _ in samples)
+            rates = sorted((elapsed - overhead) / max(cnt, 1)
+                           for elapsed, cnt in samples)
+            rate = rates[min(int(len(rates) * self.quantile), len(rates) - 1)]
+            timeout = self.margin * (overhead + rate * max(test_file_cnt, 1))
+            timeout = min(max(timeout, self.min_timeout), self.max_timeout)
+        return timeout * self.retry_factor ** attempt
+
+    def record(self, commit_hash: str, attempt: int, test_file_cnt: int,
+               timeout: float, elapsed: float, outcome: str) -> None:
+        """
+        試行の結果を記録する．成功した試行は以降の見積もりに使う．
+        :param commit_hash: 解析したコミットハッシュ．
+        :param attempt: 何度目の試行か．
+        :param test_file_cnt: 解析したテストファイルの数．
+        :param timeout: 与えたタイムアウト．
+        :param elapsed: 実際にかかった時間．
+        :param outcome: ok もしくは失敗した理由．
+        """
+        line = json_io.dumps({
+            'commit_hash': commit_hash,
+            'attempt': attempt,
+            'test_file_cnt': test_file_cnt,
+            'timeout': round(timeout, 1),
+            'elapsed': round(elapsed, 1),
+            'outcome': outcome
+        })
+        with self._lock:
+            with self.history_path.open('ab') as f:
+                f.write(line + b'\n')
+            if outcome == 'ok':
+                self._samples.append((elapsed, test_file_cnt))
+
+
+class PyNoseServerExecutor:
+    """
+    PyNose をサーバーとして常駐させ，プロジェクトのパスをソケット経由で送るクラス．
+    PyNoseExecutor と同じように使えるが，JVM と PyCharm の起動は初回のみで済む．
+    応答がタイムアウトした場合やサーバーが落ちた場合は再起動する．
+    """
+    timeout = 300
+    startup_timeout = 600
+    python_interpreter_name = 'Python 3.10'
+
+    def __init__(self, runner_path: Path, result_dir: Path, repo_prefix: Path):
+        """
+        :param runner_path: runner.py のパス．PyNose のルートの特定に使用する．
+        :param repo_prefix: リポジトリが格納されているディレクトリのパス．
+        :param result_dir: 結果を格納するディレクトリのパス．
+        """
+        self.plugin_root = runner_path.parent
+        self.result_dir = result_dir
+        self.repo_prefix = repo_prefix
+        self._process: Optional[subprocess.Popen] = None
+        self._socket: Optional[socket.socket] = None
+        self._reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def execute_pynose(self, timeout=None) -> None:
+        """
+        PyNose サーバーに解析を依頼する．
+        runner.py と同様に repo_prefix 直下のディレクトリをそれぞれ解析し，
+        result_dir に結果と log.txt を出力する．
+
+        :return: None
+        """
+        timeout = timeout or self.timeout
+        projects = [p for p in self.repo_prefix.iterdir() if p.is_dir()]
+        with (self.result_dir / 'log.txt').open('w') as f:
+            for project in projects:
+                response = self._request(project, timeout)
+                f.write(f'{project=}\n====RESPONSE====\n{response}\n\n')
+
+    def close(self) -> None:
+        """
+        サーバーを終了させる．
+        """
+        if self._socket is not None:
+            try:
+                self._socket.sendall(b'quit\n')
+            except OSError:
+                pass
+        self._kill()
+
+    def _request(self, project: Path, timeout: int) -> str:
+        """
+        1 プロジェクト分の解析を依頼し，応答を返す．
+        サーバーとの接続が切れていた場合は再起動して 1 度だけやり直す．
+        """
+        line = f'{project}\t{self.result_dir}\n'.encode('utf-8')
+        for _ in range(2):
+            if self._socket is None:
+                self._start()
+            try:
+                self._socket.settimeout(timeout)
+                self._socket.sendall(line)
+                response = self._reader.readline()
+            except socket.timeout:
+                print('Time out')
+                self._kill()
+                raise TimeoutError
+            except OSError:
+                response = b''
+
+            if response:
+                return response.decode('utf-8').rstrip('\n')
+            self._kill()
+
+        print('Failed to execute PyNose')
+        raise subprocess.CalledProcessError(1, self._command(0))
+
+    def _start(self) -> None:
+        """
+        空いているポートでサーバーを起動し，接続できるようになるまで待つ．
+        """
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+
+        log_path = self.plugin_root / 'server_log.txt'
+        with log_path.open('a') as log:
+            if os.name == 'nt':
+                self._process = subprocess.Popen(
+                    self._command(port), stdout=log, stderr=log,
+                    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+            else:
+                self._process = subprocess.Popen(
+                    self._command(port), stdout=log, stderr=log,
+                    start_new_session=True)
+
+        started = time.monotonic()
+        while time.monotonic() - started < self.startup_timeout:
+            if self._process.poll() is not None:
+                break
+            try:
+                self._socket = socket.create_connection(('127.0.0.1', port),
+                                                        timeout=5)
+                self._reader = self._socket.makefile('rb')
+                return
+            except OSError:
+                time.sleep(1)
+
+        print('Failed to start PyNose server')
+        self._kill()
+        raise subprocess.CalledProcessError(1, self._command(port))
+
+    def _command(self, port: int) -> list:
+        """
+        サーバーを起動するコマンドを作成する．
+        """
+        gradlew = 'gradlew.bat' if os.name == 'nt' else 'gradlew'
+        python = self.python_interpreter_name
+        if os.name == 'nt':
+            python = f'"{python}"'
+        return [
+            self.plugin_root / gradlew,
+            '-p', str(self.plugin_root),
+            '--no-daemon',
+            'runIde',
+            f'-PmyPython={python}',
+            f'-PmyPort={port}'
+        ]
+
+    def _kill(self) -> None:
+        """
+        サーバーをプロセスツリーごと終了させる．
+        """
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            self._reader = None
+
+        if self._process is None:
+            return
+        if self._process.poll() is None:
+            if os.name == 'nt':
+                run(['taskkill', '/F', '/T', '/PID', str(self._process.pid)],
+                    capture_output=True)
+            else:
+                try:
+                    os.killpg(self._process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        self._process.wait()
+        self._process = None
@@ -1,34 +1,250 @@
 """
 結果へのパスを与えるだけで PyNose の結果を集約できる python API を提供するモジュール．
 """
+import io
 import json
+import re
 from collections import defaultdict
 from pathlib import Path
+from typing import IO, Iterator, Optional
+
+import json_io
+from result_store import SegmentStore
+from smell_bitset import TestCaseNames, encode
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 
 class PyNoseResultManager:
     """
     json 形式で出力される PyNose の結果を扱いやすく加工してくれるクラス．
+    streaming を True にすると結果全体を読み込まず，ファイルごとに逐次読み進める．
+    巨大な結果でもメモリの使用量はテストファイル 1 つ分に収まる．
     """
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, contents: Optional[bytes] = None,
+                 streaming: bool = False):
+        """
+        :param path: 結果へのパス．contents を与えた場合はエラーの表示にのみ使う．
+        :param contents: 結果の中身．ファイル以外から読み込んだ場合に与える．
+        :param streaming: True ならば結果を逐次読み込む．この場合 original_data は None になる．
+        """
+        self.path = path
+        self.contents = contents
+        self.streaming = streaming
+        self.original_data = None
+        if streaming:
+            return
+
         try:
-            with path.open() as f:
-                self.original_data = json.load(f)
-        except json.decoder.JSONDecodeError as e:
-            print(e.msg)
+            if contents is None:
+                self.original_data = json_io.read(path)
+            else:
+                self.original_data = json_io.loads(contents)
+        except json_io.DecodeError as e:
+            print(e)
             print(f'failed to decode JSON file : {path.as_posix()}')
             raise
 
+    @classmethod
+    def from_store(cls, store: SegmentStore, commit_hash: str,
+                   streaming: bool = False) -> 'PyNoseResultManager':
+        """
+        セグメントストアに保存された結果を読み込む．
+        :param store: 結果が保存されているセグメントストア．
+        :param commit_hash: 結果に対応するコミットハッシュ．
+        :param streaming: True ならば結果を逐次読み込む．
+        """
+        contents = store.read(commit_hash)
+        if contents is None:
+            raise KeyError(commit_hash)
+        return cls(store.store_dir / commit_hash, contents, streaming)
+
+    def iter_files(self) -> Iterator[dict]:
+        """
+        テストファイルごとの結果を順に返す．
+        ijson があれば使い，なければ標準ライブラリで配列の要素を 1 つずつ読む．
+        途中から読み進める必要があるので，json_io ではなく json.JSONDecoder を使う．
+        """
+        if not self.streaming:
+            yield from self.original_data
+            return
+
+        if self.contents is None:
+            f = self.path.open('rb')
+        else:
+            f = io.BytesIO(self.contents)
+        try:
+            with f:
+                if ijson is not None:
+                    yield from ijson.items(f, 'item')
+                else:
+                    yield from iter_array_items(
+                        io.TextIOWrapper(f, encoding='utf-8'))
+        except (json.decoder.JSONDecodeError, ValueError) as e:
+            print(e)
+            print(f'failed to decode JSON file : {self.path.as_posix()}')
+            raise
+
     def count_test_smells_per_file(self) -> dict:
         """
         テストファイルにいくつのテストスメルが存在しているかを集計し，
         テストケースごとに加算する．
         """
         result = {}
-        for file in self.original_data:
+        for file in self.iter_files():
             ts_dict = defaultdict(int)
             for test_case in file['testCases']:
                 for smell in test_case['detectorResults']:
                     ts_dict[smell['name']] += int(smell['hasSmell'])
             result[file['name']] = dict(ts_dict)
         return result
+
+    def encode_smell_bitsets(self, test_case_names: TestCaseNames) -> dict:
+        """
+        テストケースごとにテストスメルをビット列にする．
+        smell_bitset.count_smell_bitsets で count_test_smells_per_file と同じ集計が得られる．
+        :param test_case_names: テストケース名の辞書．
+        :return: テストファイル名と [テストケース ID, ビット列] のリストの辞書．
+        """
+        result = {}
+        for file in self.iter_files():
+            test_cases = file['testCases']
+            test_case_ids = test_case_names.get_ids(
+                test_case['name'] for test_case in test_cases)
+            result[file['name']] = [
+                [test_case_id, encode(test_case['detectorResults'])]
+                for test_case_id, test_case in zip(test_case_ids, test_cases)]
+        return result
+
+
+# 文字列の外で要素の区切りを決める文字と，文字列の中で意味を持つ文字
+_structural = re.compile(r'["{}\[\],]')
+_string_special = re.compile(r'["\\]')
+
+
+def iter_array_items(f: IO[str], chunk_size: int = 1 << 20) -> Iterator:
+    """
+    json の配列を読み込み，要素を 1 つずつ返す．
+    必要な分だけファイルを読み進め，読み終えた要素は捨てる．
+    読み込んだ範囲に収まらない要素は，括弧と文字列の対応から終わりを探してから解析する．
+    読み足しても探した位置から続けるため，要素が何度切れ目をまたいでも解析し直さない．
+    :param f: 配列が書かれたテキストファイル．
+    :param chunk_size: 1 度に読み込む文字数．
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill() -> int:
+        """
+        ファイルを読み足し，読み終えた部分を捨てる．
+        :return: 捨てた文字数．読み足せなかった場合は -1．
+        """
+        nonlocal buffer, pos, eof
+        # 読みかけの要素より多く読み足すことで，長い要素でも複写の合計を線形に抑える
+        chunk = f.read(max(chunk_size, len(buffer) - pos))
+        if not chunk:
+            eof = True
+            return -1
+        dropped = pos
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return dropped
+
+    def skip_whitespace() -> None:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or fill() < 0:
+                return
+
+    def find_item_end() -> int:
+        """
+        pos から始まる要素の終わりを探す．
+        数値などは区切り文字の位置を返す．末尾まで読んでも見つからなければ len(buffer) を返す．
+        """
+        depth = 0
+        in_string = False
+        i = pos
+        while True:
+            if in_string:
+                match = _string_special.search(buffer, i)
+                if match is not None and match.group() == '"':
+                    in_string = False
+                    i = match.end()
+                    if depth == 0:
+                        return i
+                    continue
+                if match is not None and match.end() < len(buffer):
+                    i = match.end() + 1  # エスケープされた文字を飛ばす
+                    continue
+                # エスケープが切れ目にかかる場合は，バックスラッシュから探し直す
+                i = len(buffer) if match is None else match.start()
+            else:
+                match = _structural.search(buffer, i)
+                if match is not None:
+                    char = match.group()
+                    i = match.end()
+                    if char == '"':
+                        in_string = True
+                    elif char in '[{':
+                        depth += 1
+                    elif depth == 0:
+                        return match.start()
+                    elif char in ']}':
+                        depth -= 1
+                        if depth == 0:
+                            return i
+                    continue
+                i = len(buffer)
+            dropped = fill()
+            if dropped < 0:
+                return len(buffer)
+            i -= dropped
+
+    def is_delimited(end: int) -> bool:
+        """
+        end の後に区切り文字が読めているか．ファイルの末尾であれば，後の検査に任せて True とする．
+        """
+        following = end
+        while following < len(buffer) and buffer[following].isspace():
+            following += 1
+        if following == len(buffer):
+            return eof
+        return buffer[following] in ',]'
+
+    skip_whitespace()
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise json.JSONDecodeError('Expecting \'[\'', buffer, pos)
+    pos += 1
+
+    expecting_item = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise json.JSONDecodeError('Unterminated array', buffer, pos)
+        if buffer[pos] == ']':
+            return
+        if not expecting_item:
+            if buffer[pos] != ',':
+                raise json.JSONDecodeError('Expecting \',\' delimiter',
+                                           buffer, pos)
+            pos += 1
+            skip_whitespace()
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            end = None
+        # 数値などは切れ目で終わったように見えることがあるので，区切り文字まで読めていることを確かめる
+        if end is None or not is_delimited(end):
+            # 要素が切れ目をまたいでいる場合は，終わりまで読んでから 1 度だけ解析する
+            find_item_end()
+            item, end = decoder.raw_decode(buffer, pos)
+        pos = end
+        expecting_item = False
+        yield item
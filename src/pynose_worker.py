@@ -0,0 +1,174 @@
+"""
+自分専用の git worktree と PyNose を持つワーカーを提供するモジュール．
+ワーカーを複数用意することで，同じリポジトリのコミットを並列に解析できる．
+"""
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from global_var import runner_path, use_pynose_server
+from object_reader import ObjectReader, TreeEntry
+from pynose_executor import (PyNoseExecutor, PyNoseServerExecutor,
+                             TimeoutPolicy)
+from repo import Repo
+
+
+class PyNoseWorker:
+    """
+    work_dir 以下に PyNose のコピー，worktree，出力先を持ち，
+    1 コミットずつ PyNose を実行するクラス．
+
+    work_dir の構成：
+    PyNose/       PyNose のコピー．
+    repo/<name>/  解析対象のリポジトリの worktree．PyNose の repo_prefix になる．
+    output/       PyNose の出力先．
+    """
+    # 同じリポジトリへの git worktree add/remove が同時に走らないようにする．
+    _worktree_lock = threading.Lock()
+
+    def __init__(self, work_dir: Path):
+        """
+        :param work_dir: ワーカー専用のディレクトリ．既に存在する場合は作り直す．
+        """
+        self.work_dir = work_dir
+        self.pynose_instance_path = work_dir / 'PyNose'
+        self.repo_prefix = work_dir / 'repo'
+        self.output_dir = work_dir / 'output'
+
+        if work_dir.exists():
+            remove_dir(work_dir)
+        shutil.copytree(runner_path.parent, self.pynose_instance_path)
+        self.repo_prefix.mkdir(parents=True)
+        self.output_dir.mkdir()
+
+        executor_class \
+            = PyNoseServerExecutor if use_pynose_server else PyNoseExecutor
+        self.executor = executor_class(
+            runner_path=self.pynose_instance_path / 'runner.py',
+            result_dir=self.output_dir,
+            repo_prefix=self.repo_prefix
+        )
+        self.repo: Optional[Repo] = None
+        self._worktree: Optional[Repo] = None
+
+    def attach(self, repo: Repo) -> None:
+        """
+        解析対象のリポジトリの worktree を用意する．
+        既に同じリポジトリを担当している場合は何もしない．
+        :param repo: 解析対象のリポジトリ．
+        """
+        if self.repo is repo:
+            return
+        self.detach()
+        with self._worktree_lock:
+            self._worktree = repo.add_worktree(self.repo_prefix / repo.name)
+        self.repo = repo
+
+    def detach(self) -> None:
+        """
+        担当しているリポジトリの worktree を削除する．
+        """
+        if self.repo is None:
+            return
+        with self._worktree_lock:
+            self.repo.remove_worktree(self.repo_prefix / self.repo.name)
+        self.repo = None
+        self._worktree = None
+
+    def analyze(self, repo: Repo, index: int, commit_hash: str, results,
+                log_file_path: Path, timeout_policy: TimeoutPolicy) \
+            -> Optional[str]:
+        """
+        コミットをチェックアウトして PyNose を実行し，結果を保存先に移す．
+        タイムアウトした場合は，タイムアウトを延ばして 1 度だけやり直す．
+        :param repo: 解析対象のリポジトリ．
+        :param index: 解析対象のコミットの順番．
+        :param commit_hash: 解析対象のコミットハッシュ．
+        :param results: 結果の保存先．LooseResults もしくは SegmentResults．
+        :param log_file_path: 結果が出力されなかった場合のログの移動先．
+        :param timeout_policy: 解析対象のリポジトリのタイムアウトの決め方．
+        :return: 失敗した場合はその理由．成功した場合は None．
+        """
+        default_result_file_path = self.output_dir / f'{repo.name}.json'
+        default_log_file_path = self.output_dir / 'log.txt'
+
+        tree = select_test_files(repo.list_tree(commit_hash))
+        self.attach(repo)
+        self._worktree.checkout(commit_hash)
+
+        for attempt in range(2):
+            # 前回の実行の出力が残っていると，今回の結果と取り違えてしまう
+            default_result_file_path.unlink(missing_ok=True)
+            timeout = timeout_policy.timeout(len(tree), attempt)
+            started = time.monotonic()
+            try:
+                self.executor.execute_pynose(timeout)
+            except TimeoutError:
+                timeout_policy.record(commit_hash, attempt, len(tree),
+                                      timeout, time.monotonic() - started,
+                                      'Timeout')
+                continue
+            except subprocess.CalledProcessError:
+                timeout_policy.record(commit_hash, attempt, len(tree),
+                                      timeout, time.monotonic() - started,
+                                      'Failed')
+                raise
+            break
+        else:
+            return 'Timeout'
+        elapsed = time.monotonic() - started
+
+        if not default_result_file_path.exists():
+            print('PyNose did not output result file')
+            try:
+                default_log_file_path.rename(log_file_path)
+            except FileNotFoundError:
+                print('PyNose did not output log file')
+            timeout_policy.record(commit_hash, attempt, len(tree), timeout,
+                                  elapsed, 'OnlyLogFile')
+            return 'OnlyLogFile'
+        default_log_file_path.unlink(missing_ok=True)
+        timeout_policy.record(commit_hash, attempt, len(tree), timeout,
+                              elapsed, 'ok')
+        results.put(index, commit_hash, default_result_file_path)
+        return None
+
+    def close(self) -> None:
+        """
+        PyNose を終了させ，worktree と work_dir を削除する．
+        """
+        self.executor.close()
+        self.detach()
+        if self.work_dir.exists():
+            remove_dir(self.work_dir)
+
+
+def select_test_files(tree: list[TreeEntry]) -> list[TreeEntry]:
+    """
+    PyNose がテストケースを見つけうるファイルを取り出す．
+    PyNose はすべての .py ファイルを読むが，テストケースを持つファイルは
+    パスに test を含むものとみなす．シンボリックリンクは除く．
+    :param tree: コミットに含まれるファイル．
+    """
+    return [entry for entry in tree if entry.path.endswith('.py')
+            and 'test' in entry.path.lower()
+            and entry.mode != ObjectReader.symlink_mode]
+
+
+def remove_dir(dir_path: Path):
+    """
+    ディレクトリを削除しようと試みる．
+    PyNose の終了直後はファイルが掴まれていることがあるので待ってからやり直す．
+    :param dir_path: 削除するディレクトリのパス．
+    """
+    try:
+        shutil.rmtree(dir_path)
+    except FileNotFoundError:
+        time.sleep(3)
+        shutil.rmtree(dir_path)
+    except OSError:
+        time.sleep(3)
+        shutil.rmtree(dir_path)
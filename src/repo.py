@@ -1,12 +1,18 @@
 """
 リポジトリを扱うクラス．
 """
+import shutil
 from datetime import datetime
+from functools import cached_property
 from pathlib import Path
 from typing import Optional
 
 import git
 
+from commit_index import ChangeCountTable, CommitIndex
+from import_cache import ImportCache
+from object_reader import ObjectReader, TreeEntry
+
 
 class Repo:
     """
@@ -19,6 +25,66 @@ class Repo:
         self.branch_name = self._repo.branches[0] # noqa
         self.name: str = repo_path.name
 
+    @cached_property
+    def commit_index(self) -> CommitIndex:
+        """
+        コミットの情報を 1 回の git log で集めたインデックス．
+        初回アクセス時に読み込み，新しいコミットがあれば追記する．
+        """
+        return CommitIndex(self.repo_path,
+                           Path(self._repo.common_dir),
+                           str(self.branch_name))
+
+    @cached_property
+    def change_counts(self) -> ChangeCountTable:
+        """
+        ファイルごとの変更回数の表．コミットインデックスと同じファイルに保存される．
+        """
+        return ChangeCountTable(self.repo_path,
+                                Path(self._repo.common_dir),
+                                str(self.branch_name))
+
+    @cached_property
+    def object_reader(self) -> ObjectReader:
+        """
+        チェックアウトせずにオブジェクトを読むための常駐の git cat-file．
+        """
+        return ObjectReader(self.repo_path)
+
+    @cached_property
+    def import_cache(self) -> ImportCache:
+        """
+        ファイルの blob ごとのインポートの一覧．.git 内に保存される．
+        """
+        return ImportCache(Path(self._repo.common_dir))
+
+    def list_tree(self, commit_hash: str) -> list[TreeEntry]:
+        """
+        指定したコミットに含まれるファイルを列挙する．
+        :param commit_hash: 対象のコミットハッシュ．
+        :return: パス，モード，オブジェクト ID のリスト．
+        """
+        return self.object_reader.list_tree(commit_hash)
+
+    def read_blob(self, object_id: str) -> Optional[bytes]:
+        """
+        オブジェクト ID を指定してファイルの中身を読み込む．
+        :param object_id: blob のオブジェクト ID．
+        """
+        return self.object_reader.read(object_id)
+
+    def read_text(self, commit_hash: str, file_path: Path,
+                  encoding: str = 'utf-8') -> Optional[str]:
+        """
+        指定したコミットにおけるファイルの中身をチェックアウトせずに読み込む．
+        :param commit_hash: 対象のコミットハッシュ．
+        :param file_path: リポジトリのルートからの相対パス．
+        :param encoding: 文字コード．
+        :return: ファイルの中身．存在しない場合は None．
+        """
+        name = f'{commit_hash}:{Path(file_path).as_posix()}'
+        return self.object_reader.read_text(name, encoding)
+
     def get_commit_hashes(self, until: Optional[datetime] = None) -> list:
         """
         コミットハッシュを取得する．
@@ -26,10 +92,7 @@ class Repo:
         :param until: どの時点までのコミットハッシュを取得するか．デフォルトは最新まで．
         :return: コミットハッシュのリスト．
         """
-        commits = self._repo.iter_commits(self.branch_name,
-                                          reverse=True,
-                                          until=until)
-        return [commit.hexsha for commit in commits]
+        return self.commit_index.get_commit_hashes(until)
 
     def get_commit_messages(self, until: Optional[datetime] = None) -> list:
         """
@@ -38,10 +101,7 @@ class Repo:
         :param until: どの時点までのコミットメッセージを取得するか．デフォルトは最新まで．
         :return: コミットメッセージのリスト．
         """
-        commits = self._repo.iter_commits(self.branch_name,
-                                          reverse=True,
-                                          until=until)
-        return [commit.message for commit in commits]
+        return self.commit_index.get_commit_messages(until)
 
     def checkout(self, commit_hash: str) -> None:
         """
@@ -59,6 +119,32 @@ class Repo:
             raise
         print(f'finish checkout {commit_hash}')
 
+    def add_worktree(self, worktree_path: Path) -> 'Repo':
+        """
+        このリポジトリの worktree を作成する．
+        中身は checkout するまで展開しない．
+        :param worktree_path: worktree を作成するパス．
+        :return: worktree を操作するクラス．
+        """
+        if worktree_path.exists():
+            self.remove_worktree(worktree_path)
+        self._repo.git.worktree('prune')
+        self._repo.git.worktree('add', '--detach', '--no-checkout',
+                                worktree_path.as_posix())
+        return Repo(worktree_path)
+
+    def remove_worktree(self, worktree_path: Path) -> None:
+        """
+        add_worktree で作成した worktree を削除する．
+        :param worktree_path: 削除する worktree のパス．
+        """
+        try:
+            self._repo.git.worktree('remove', '--force', '--force',
+                                    worktree_path.as_posix())
+        except git.exc.GitCommandError:
+            shutil.rmtree(worktree_path, ignore_errors=True)
+            self._repo.git.worktree('prune')
+
     def get_clone_url(self) -> str:
         """
         clone 用の url を取得する．
@@ -68,10 +154,13 @@ class Repo:
 
     def get_parents(self, commit_hash: str) -> list:
         """
-        与えられたコミットハッシュの親が 2 つであるかを判定する．
+        与えられたコミットハッシュの親のコミットハッシュを返す．
+        親が 2 つであるかの判定に使用する．
         """
+        if commit_hash in self.commit_index:
+            return self.commit_index.get_parents(commit_hash)
         commit = self._repo.commit(commit_hash)
-        return list(commit.parents)
+        return [parent.hexsha for parent in commit.parents]
 
     def get_base_commit_hash(self, commit_hash: str) -> Optional[str]:
         """
@@ -87,6 +176,9 @@ class Repo:
         """
         そのコミットで変更のあったファイルを取得する．
         """
+        if commit_hash in self.commit_index:
+            return self.commit_index.get_changed_files(commit_hash)
+
         changed_files = []
         option = ['-m', '--pretty=format:', '--name-only']
         git_output = self._repo.git.show(*option, commit_hash)
@@ -98,8 +190,7 @@ class Repo:
     def get_changed_times(self, file_path: Path):
         """
         与えられた file_path が何回変更されたかを返す．
+        リネーム前の変更も含める．
         :param file_path: 対象のファイルパス．
         """
-        options = ['--follow', '--pretty=format:%H', '--']
-        commit_hashes = self._repo.git.log(*options, file_path).splitlines()
-        return len(commit_hashes)
+        return self.change_counts.get_changed_times(Path(file_path).as_posix())
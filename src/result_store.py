@@ -0,0 +1,350 @@
+"""
+PyNose の結果をコミットごとに保存し，読み出す python API を提供するモジュール．
+コミットごとの json ファイルとして保存する従来の形式と，
+リポジトリごとに追記専用のセグメントファイルへまとめて保存する形式がある．
+"""
+import os
+import shutil
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+from atomic_io import atomic_write
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def result_file_name(repo_name: str, index: int, commit_hash: str) -> str:
+    """
+    結果のファイル名を返す．
+    """
+    return f'{repo_name}_{index:06d}_{commit_hash}.json'
+
+
+def log_file_name(repo_name: str, index: int, commit_hash: str) -> str:
+    """
+    結果が出力されなかった場合のログのファイル名を返す．
+    """
+    return f'{repo_name}_{index:06d}_{commit_hash}.txt'
+
+
+class Record(NamedTuple):
+    """
+    インデックスの 1 行分．
+    """
+    ordinal: int
+    commit_hash: str
+    codec: str
+    segment: int
+    offset: int
+    length: int
+
+
+class SegmentStore:
+    """
+    1 つのリポジトリの結果を追記専用のセグメントファイルに圧縮してまとめるクラス．
+    各レコードはコミットの順番とコミットハッシュで引ける．
+
+    store_dir の構成：
+    index.tsv     「順番<TAB>ハッシュ<TAB>圧縮形式<TAB>セグメント<TAB>位置<TAB>長さ」の行．
+    NNNNNN.seg    圧縮されたレコードを連結したもの．segment_size を超えると次に移る．
+
+    zstandard があれば zstd で，なければ zlib で圧縮する．
+    セグメントに書いてからインデックスに追記するので，中断されても
+    インデックスに載っているレコードは常に完全である．
+    """
+    index_file_name = 'index.tsv'
+    segment_size = 1 << 30
+    zstd_level = 3
+
+    def __init__(self, store_dir: Path, read_only: bool = False):
+        """
+        :param store_dir: セグメントとインデックスを格納するディレクトリ．
+        :param read_only: True ならばインデックスを修復しない．
+        書き込み中のストアを別のプロセスから読むときに使う．
+        末尾の書きかけの行は読み飛ばすだけで，修復は書き込む側に任せる．
+        """
+        self.store_dir = store_dir
+        self.index_path = store_dir / self.index_file_name
+        self._records: dict[str, Record] = {}
+        self._lock = threading.Lock()
+        self._readers = {}
+        self._segment = 0
+
+        truncated = False
+        if self.index_path.exists():
+            with self.index_path.open() as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        truncated = True  # 書き込み中に中断された行
+                        continue
+                    ordinal, commit_hash, codec, segment, offset, length \
+                        = line.rstrip('\n').split('\t')
+                    record = Record(int(ordinal), commit_hash, codec,
+                                    int(segment), int(offset), int(length))
+                    self._records[commit_hash] = record
+                    self._segment = max(self._segment, record.segment)
+        if truncated and not read_only:
+            self._rewrite_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, commit_hash: str) -> bool:
+        return commit_hash in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def records(self) -> list[Record]:
+        """
+        保存されているレコードをコミットの順番に並べて返す．
+        """
+        return sorted(self._records.values(), key=lambda record: record.ordinal)
+
+    def put(self, ordinal: int, commit_hash: str, contents: bytes) -> None:
+        """
+        結果を圧縮して追記する．
+        :param ordinal: コミットの順番．1 から始まる．
+        :param commit_hash: コミットハッシュ．
+        :param contents: 結果の中身．
+        """
+        codec, compressed = compress(contents)
+        with self._lock:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            segment_path = self._segment_path(self._segment)
+            if segment_path.exists() \
+                    and segment_path.stat().st_size >= self.segment_size:
+                self._segment += 1
+                segment_path = self._segment_path(self._segment)
+            with segment_path.open('ab') as f:
+                offset = f.tell()
+                f.write(compressed)
+            self._append(Record(ordinal, commit_hash, codec, self._segment,
+                                offset, len(compressed)))
+
+    def link(self, ordinal: int, commit_hash: str, src_commit_hash: str) -> None:
+        """
+        既に保存されている結果を別のコミットの結果としても参照させる．中身は複製しない．
+        :param ordinal: コミットの順番．
+        :param commit_hash: コミットハッシュ．
+        :param src_commit_hash: 使い回す結果のコミットハッシュ．
+        """
+        with self._lock:
+            src = self._records[src_commit_hash]
+            self._append(src._replace(ordinal=ordinal, commit_hash=commit_hash))
+
+    def read(self, commit_hash: str) -> Optional[bytes]:
+        """
+        結果を読み込む．
+        :param commit_hash: コミットハッシュ．
+        :return: 結果の中身．保存されていない場合は None．
+        """
+        record = self._records.get(commit_hash)
+        if record is None:
+            return None
+        with self._lock:
+            reader = self._readers.get(record.segment)
+            if reader is None:
+                reader = self._segment_path(record.segment).open('rb')
+                self._readers[record.segment] = reader
+            reader.seek(record.offset)
+            compressed = reader.read(record.length)
+        return decompress(record.codec, compressed)
+
+    def iter_results(self) -> Iterator[tuple[Record, bytes]]:
+        """
+        すべての結果をコミットの順番に読み込む．
+        """
+        for record in self.records():
+            yield record, self.read(record.commit_hash)
+
+    def close(self) -> None:
+        """
+        開いているセグメントを閉じる．
+        """
+        with self._lock:
+            for reader in self._readers.values():
+                reader.close()
+            self._readers.clear()
+
+    def _append(self, record: Record) -> None:
+        with self.index_path.open('a') as f:
+            f.write('\t'.join(map(str, record)) + '\n')
+        self._records[record.commit_hash] = record
+
+    def _rewrite_index(self) -> None:
+        tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+        with tmp_path.open('w') as f:
+            for record in self.records():
+                f.write('\t'.join(map(str, record)) + '\n')
+        os.replace(tmp_path, self.index_path)
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.store_dir / f'{segment:06d}.seg'
+
+
+def compress(contents: bytes) -> tuple[str, bytes]:
+    """
+    利用できる最良の形式で圧縮する．
+    :return: 圧縮形式と圧縮したバイト列．
+    """
+    if zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=SegmentStore.zstd_level)
+        return 'zstd', compressor.compress(contents)
+    return 'zlib', zlib.compress(contents)
+
+
+def decompress(codec: str, compressed: bytes) -> bytes:
+    """
+    圧縮形式に従って展開する．
+    """
+    if codec == 'zlib':
+        return zlib.decompress(compressed)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is required to read this record')
+        return zstandard.ZstdDecompressor().decompress(compressed)
+    raise ValueError(f'unknown codec: {codec}')
+
+
+class LooseResults:
+    """
+    結果をコミットごとの json ファイルとして result_dir に保存する従来の形式．
+    """
+
+    def __init__(self, result_dir: Path, repo_name: str):
+        """
+        :param result_dir: 結果を格納するディレクトリ．
+        :param repo_name: リポジトリ名．
+        """
+        self.result_dir = result_dir
+        self.repo_name = repo_name
+
+    def path(self, index: int, commit_hash: str) -> Path:
+        """
+        結果のファイルパスを返す．
+        """
+        return self.result_dir / result_file_name(self.repo_name, index,
+                                                  commit_hash)
+
+    def contains(self, index: int, commit_hash: str) -> bool:
+        """
+        すでにファイルが存在しているならば解析済みである．
+        """
+        return self.path(index, commit_hash).exists()
+
+    def put(self, index: int, commit_hash: str, file_path: Path) -> None:
+        """
+        PyNose が出力したファイルを所定の場所に移動する．
+        """
+        shutil.move(file_path, self.path(index, commit_hash))
+
+    def reuse(self, index: int, commit_hash: str,
+              src_index: int, src_commit_hash: str) -> None:
+        """
+        結果ファイルを使い回す．可能であればハードリンクにし，容量を消費しない．
+        """
+        src = self.path(src_index, src_commit_hash)
+        dst = self.path(index, commit_hash)
+        try:
+            os.link(src, dst)
+        except OSError:
+            # 書きかけのファイルが出力先に現れないように，一時ファイルに複製してから置き換える
+            with src.open('rb') as f_src, atomic_write(dst, 'wb') as f_dst:
+                shutil.copyfileobj(f_src, f_dst)
+
+    def read(self, index: int, commit_hash: str) -> Optional[bytes]:
+        """
+        結果を読み込む．存在しない場合は None．
+        """
+        try:
+            return self.path(index, commit_hash).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def close(self) -> None:
+        """
+        SegmentResults と同じように扱えるように用意している．
+        """
+
+
+class SegmentResults:
+    """
+    結果を result_dir/segments の SegmentStore に保存する形式．
+    LooseResults と同じように扱える．
+    切り替える前に json ファイルとして保存された結果も解析済みとして扱う．
+    """
+    dir_name = 'segments'
+
+    def __init__(self, result_dir: Path, repo_name: str,
+                 read_only: bool = False):
+        """
+        :param result_dir: 結果を格納するディレクトリ．
+        :param repo_name: リポジトリ名．
+        :param read_only: True ならばストアを修復しない．解析中の結果を読むときに使う．
+        """
+        self.result_dir = result_dir
+        self.repo_name = repo_name
+        self.store = SegmentStore(result_dir / self.dir_name, read_only)
+        self._loose = LooseResults(result_dir, repo_name)
+
+    def contains(self, index: int, commit_hash: str) -> bool:
+        """
+        ストアに載っているか，json ファイルが存在しているならば解析済みである．
+        """
+        return commit_hash in self.store \
+            or self._loose.contains(index, commit_hash)
+
+    def put(self, index: int, commit_hash: str, file_path: Path) -> None:
+        """
+        PyNose が出力したファイルをストアに追記し，削除する．
+        """
+        self.store.put(index, commit_hash, file_path.read_bytes())
+        file_path.unlink()
+
+    def reuse(self, index: int, commit_hash: str,
+              src_index: int, src_commit_hash: str) -> None:
+        """
+        結果を使い回す．ストア内では同じレコードを指すだけである．
+        """
+        if src_commit_hash not in self.store:
+            self.store.put(src_index, src_commit_hash,
+                           self._loose.read(src_index, src_commit_hash))
+        self.store.link(index, commit_hash, src_commit_hash)
+
+    def read(self, index: int, commit_hash: str) -> Optional[bytes]:
+        """
+        結果を読み込む．存在しない場合は None．
+        """
+        contents = self.store.read(commit_hash)
+        if contents is None:
+            return self._loose.read(index, commit_hash)
+        return contents
+
+    def close(self) -> None:
+        """
+        ストアを閉じる．
+        """
+        self.store.close()
+
+
+def open_results(result_dir: Path, repo_name: str, use_segments: bool,
+                 read_only: bool = False):
+    """
+    設定に応じて結果の保存先を開く．
+    :param result_dir: 結果を格納するディレクトリ．
+    :param repo_name: リポジトリ名．
+    :param use_segments: True ならば SegmentResults，そうでなければ LooseResults．
+    :param read_only: True ならばストアを修復しない．解析中の結果を読むときに使う．
+    """
+    if use_segments:
+        return SegmentResults(result_dir, repo_name, read_only)
+    return LooseResults(result_dir, repo_name)
@@ -0,0 +1,214 @@
+"""
+../repo 以下のすべてのリポジトリに対して PyNose をコミットごとに実行するプログラム．
+start と end を手で分けて複数の端末で動かす代わりに，ワーカーを自動で割り当てる．
+コミット数の多いリポジトリから順に着手し，手の空いたワーカーは
+残りのコミットが最も多いリポジトリに加勢する．
+"""
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+from tqdm import tqdm
+
+from error_registry import ErrorRegistry
+from execute_pynose_per_commit import (analyze_job, attempts_file_name,
+                                       finish_job, open_pynose_results,
+                                       plan_jobs)
+from global_var import deadline, pynose_scheduler_worker_cnt
+from pynose_executor import TimeoutPolicy
+from pynose_worker import PyNoseWorker, remove_dir
+from repo import Repo
+
+
+class RepoJobs:
+    """
+    1 つのリポジトリの未解析のコミットを管理するクラス．
+    """
+
+    def __init__(self, repo: Repo, result_dir: Path):
+        """
+        :param repo: 解析対象のリポジトリ．
+        :param result_dir: 結果を格納するディレクトリ．
+        """
+        self.repo = repo
+        self.result_dir = result_dir
+        self.results = open_pynose_results(result_dir, repo.name)
+        self.errors = ErrorRegistry(result_dir, repo.name)
+        self.timeout_policy = TimeoutPolicy(result_dir
+                                            / attempts_file_name(repo))
+        self.commit_cnt = len(repo.get_commit_hashes(until=deadline))
+        self.pending = deque(plan_jobs(repo, self.results, self.errors))
+        self.started = False
+
+
+class Scheduler:
+    """
+    ワーカーにリポジトリとコミットを割り当て，進捗を表示するクラス．
+    """
+    report_interval = 60
+
+    def __init__(self, repo_jobs: list[RepoJobs], work_root: Path,
+                 worker_cnt: int):
+        """
+        :param repo_jobs: 未解析のコミットを持つリポジトリ．
+        :param work_root: ワーカーのディレクトリを作成するディレクトリ．
+        :param worker_cnt: ワーカーの数．
+        """
+        self.repo_jobs = sorted(repo_jobs, key=lambda jobs: jobs.commit_cnt,
+                                reverse=True)
+        self.work_root = work_root
+        self.worker_cnt = worker_cnt
+        self.total = sum(len(jobs.pending) for jobs in repo_jobs)
+        self.workers: list[PyNoseWorker] = []
+        self.done_cnt: list[int] = []
+        self.current: list[str] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pbar: Optional[tqdm] = None
+
+    def run(self) -> None:
+        """
+        すべてのコミットを解析し終えるまでワーカーを動かす．
+        """
+        self.workers = [PyNoseWorker(self.work_root / f'{i:02d}')
+                        for i in range(self.worker_cnt)]
+        self.done_cnt = [0] * self.worker_cnt
+        self.current = [''] * self.worker_cnt
+        started = time.monotonic()
+
+        threads = [threading.Thread(target=self._work, args=(i,), daemon=True)
+                   for i in range(self.worker_cnt)]
+        with tqdm(total=self.total) as self._pbar:
+            for thread in threads:
+                thread.start()
+            try:
+                while any(thread.is_alive() for thread in threads):
+                    for thread in threads:
+                        thread.join(timeout=self.report_interval
+                                    / len(threads))
+                    self._report(time.monotonic() - started)
+            except KeyboardInterrupt:
+                # 解析中の worktree を消さないように，実行中のコミットを終えるまで待つ
+                self._stop.set()
+                tqdm.write('waiting for running commits to finish')
+                for thread in threads:
+                    thread.join()
+                self.close()
+                sys.exit(0)
+        self.close()
+
+    def close(self) -> None:
+        """
+        ワーカーを終了させ，ワーカーのディレクトリを削除する．
+        """
+        for worker in self.workers:
+            worker.close()
+        for jobs in self.repo_jobs:
+            jobs.results.close()
+        if self.work_root.exists():
+            remove_dir(self.work_root)
+
+    def _work(self, worker_id: int) -> None:
+        """
+        ワーカーごとのスレッドで，割り当てられたコミットを解析し続ける．
+        解析中の例外はコミットの失敗として記録し，スレッドは止めない．
+        """
+        worker = self.workers[worker_id]
+        jobs = None
+        try:
+            while not self._stop.is_set():
+                with self._lock:
+                    jobs = self._assign(jobs)
+                    if jobs is None:
+                        break
+                    job = jobs.pending.popleft()
+                    self.current[worker_id] = jobs.repo.name
+
+                reason = analyze_job(worker, jobs.repo, job, jobs.results,
+                                     jobs.result_dir, jobs.timeout_policy)
+
+                with self._lock:
+                    retry = finish_job(jobs.results, jobs.errors, job, reason)
+                    if retry is not None:
+                        jobs.pending.appendleft(retry)
+                        self.total += 1
+                        self._pbar.total = self.total
+                    self.done_cnt[worker_id] += 1
+                    self._pbar.update()
+        finally:
+            self.current[worker_id] = ''
+            worker.detach()
+
+    def _assign(self, jobs: Optional[RepoJobs]) -> Optional[RepoJobs]:
+        """
+        次に解析するリポジトリを決める．
+        担当中のリポジトリにコミットが残っていればそのまま続け，
+        なければ未着手のリポジトリのうち最大のものを，
+        それもなければ残りのコミットが最も多いリポジトリを選ぶ．
+        """
+        if jobs is not None and jobs.pending:
+            return jobs
+
+        for candidate in self.repo_jobs:
+            if not candidate.started and candidate.pending:
+                candidate.started = True
+                return candidate
+
+        remaining = [candidate for candidate in self.repo_jobs
+                     if candidate.pending]
+        if not remaining:
+            return None
+        return max(remaining, key=lambda candidate: len(candidate.pending))
+
+    def _report(self, elapsed: float) -> None:
+        """
+        ワーカーごとのスループットと全体の残り時間の見込みを表示する．
+        """
+        hours = elapsed / 3600
+        lines = []
+        for worker_id, (done, repo_name) \
+                in enumerate(zip(self.done_cnt, self.current)):
+            lines.append(f'worker {worker_id:02d}: {done:>7d} commits '
+                         f'{done / hours if hours else 0:>7.1f}/h '
+                         f'{repo_name}')
+        done = sum(self.done_cnt)
+        if done:
+            eta = (self.total - done) * elapsed / done / 3600
+            lines.append(f'total: {done}/{self.total} ETA {eta:.1f} h')
+        tqdm.write('\n'.join(lines))
+
+
+def main():
+    """
+    ../repo 以下のリポジトリを読み込み，未解析のコミットを持つものを解析する．
+    """
+    result_root = Path('../result/execute_pynose_per_commit').resolve()
+    work_root = Path('../pynose_scheduler').resolve()
+
+    repo_jobs = []
+    target_list = sorted(Path('../repo').resolve(strict=True).glob('*'))
+    for repo_prefix in tqdm(target_list, desc='loading'):
+        try:
+            repo_path = repo_prefix.glob('*').__next__()
+        except StopIteration:
+            continue
+        repo = Repo(repo_path)
+        result_dir = result_root / repo.name
+        result_dir.mkdir(exist_ok=True, parents=True)
+        jobs = RepoJobs(repo, result_dir)
+        if jobs.pending:
+            repo_jobs.append(jobs)
+
+    if not repo_jobs:
+        return
+
+    worker_cnt = min(pynose_scheduler_worker_cnt,
+                     sum(len(jobs.pending) for jobs in repo_jobs))
+    Scheduler(repo_jobs, work_root, worker_cnt).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,10 @@ from pathlib import Path
 
 from tqdm import tqdm
 
-from global_var import deadline
+from error_registry import ErrorRegistry
+from global_var import deadline, use_segment_store
 from repo import Repo
+from result_store import open_results
 
 
 def main():
@@ -28,36 +30,33 @@ def main():
 
         result_dir \
             = Path(f'../result/execute_pynose_per_commit/{repo_name}').resolve()
-        errors = get_errors(result_dir)
+        errors = get_errors(result_dir, repo_name)
+        results = open_results(result_dir, repo_name, use_segment_store,
+                               read_only=True)
         commit_hashes = repo.get_commit_hashes(until=deadline)
         analyzed = 0
         total = 0
         for index, commit_hash in enumerate(commit_hashes, 1):
-            result_file_name = f'{repo_name}_{index:06d}_{commit_hash}.json'
-            result_file_path = result_dir / result_file_name
-
-            if result_file_path.exists() or (commit_hash in errors):
+            if results.contains(index, commit_hash) or (commit_hash in errors):
                 analyzed += 1
             total += 1
+        results.close()
 
         if analyzed != total:
+            reasons = ', '.join(f'{reason}: {cnt}' for reason, cnt
+                                in errors.count_reasons().most_common())
             tqdm.write(f'{repo_prefix.stem}: {analyzed*100/total:>6.2f}% '
-                       f'{analyzed:>6d} {total:>6d}')
+                       f'{analyzed:>6d} {total:>6d} {reasons}')
 
 
-def get_errors(path: Path):
+def get_errors(path: Path, repo_name: str) -> ErrorRegistry:
     """
-    エラーファイルが存在する場合はその内容を返す．
-    存在しない場合は空文字を返す．
-    :param path: エラーファイルが存在すれば格納されているディレクトリのパス．
+    エラーとなったコミットの記録を読み込む．
+    記録が存在しない場合は空の記録を返す．
+    :param path: エラーの記録が格納されているディレクトリのパス．
+    :param repo_name: リポジトリ名．
     """
-    try:
-        error_file_path = path.glob('*error*').__next__()
-    except StopIteration:
-        return ''
-
-    with error_file_path.open() as f:
-        return f.read()
+    return ErrorRegistry(path, repo_name, read_only=True)
 
 
 if __name__ == '__main__':
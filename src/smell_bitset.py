@@ -0,0 +1,153 @@
+"""
+PyNose の結果をテストケースごとのテストスメルのビット列として保存する python API を提供するモジュール．
+ファイルごとの数に集約すると失われる，どのテストケースがどのテストスメルを持つかを
+元の結果よりはるかに小さく残す．
+"""
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable
+
+from smell_matrix import SMELL_COLUMNS, SMELLS, warn_unknown_smell
+
+
+class TestCaseNames:
+    """
+    テストケース名と ID の対応をリポジトリごとに SQLite に保存するクラス．
+    複数のプロセスから同時に登録されても同じ名前には同じ ID を返す．
+    """
+
+    def __init__(self, path: Path):
+        """
+        :param path: データベースのパス．
+        """
+        self._conn = sqlite3.connect(path, timeout=60,
+                                     check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS test_cases ('
+                           'id INTEGER PRIMARY KEY, '
+                           'name TEXT NOT NULL UNIQUE)')
+        self._conn.commit()
+        self._ids: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get_ids(self, names: Iterable[str]) -> list[int]:
+        """
+        テストケース名の ID を返す．未登録の名前は登録する．
+        :param names: テストケース名．
+        """
+        names = list(names)
+        with self._lock:
+            unknown = list({name for name in names if name not in self._ids})
+            if unknown:
+                self._conn.executemany(
+                    'INSERT OR IGNORE INTO test_cases (name) VALUES (?)',
+                    [(name,) for name in unknown])
+                self._conn.commit()
+                # SQLite の変数の上限を超えないように分割する
+                for i in range(0, len(unknown), 500):
+                    chunk = unknown[i:i + 500]
+                    placeholders = ', '.join('?' * len(chunk))
+                    rows = self._conn.execute(
+                        f'SELECT name, id FROM test_cases '
+                        f'WHERE name IN ({placeholders})', chunk)
+                    self._ids.update(rows)
+            return [self._ids[name] for name in names]
+
+    def get_names(self) -> dict[int, str]:
+        """
+        登録されているすべての ID とテストケース名の辞書を返す．
+        """
+        with self._lock:
+            return dict(self._conn.execute('SELECT id, name FROM test_cases'))
+
+    def close(self) -> None:
+        """
+        データベースを閉じる．
+        """
+        with self._lock:
+            self._conn.close()
+
+
+def smell_bitset_dir(repo_name: str) -> Path:
+    """
+    リポジトリのビット列を格納するディレクトリを返す．
+    """
+    this_file_name = Path(__file__).stem
+    return Path('../result/').resolve() / this_file_name / repo_name
+
+
+@lru_cache(maxsize=None)
+def open_test_case_names(repo_name: str) -> TestCaseNames:
+    """
+    リポジトリのテストケース名の辞書を開く．プロセスごとに 1 度だけ開く．
+    辞書は結果のディレクトリを glob する処理に混ざらないように，ディレクトリの隣に置く．
+    :param repo_name: リポジトリ名．
+    """
+    path = smell_bitset_dir(repo_name).with_suffix('.sqlite3')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return TestCaseNames(path)
+
+
+def encode(detector_results: list) -> int:
+    """
+    1 つのテストケースの detectorResults をビット列にする．
+    ビット i は SMELLS[i] を持つことを表す．
+    SMELLS にないテストスメルは，PyNose の検出器が増えたか名前が変わったものとみなして読み飛ばし，
+    名前ごとに 1 度だけ警告する．
+    """
+    bitmask = 0
+    for smell in detector_results:
+        column = SMELL_COLUMNS.get(smell['name'])
+        if column is None:
+            warn_unknown_smell(smell['name'])
+            continue
+        if smell['hasSmell']:
+            bitmask |= 1 << column
+    return bitmask
+
+
+def decode(bitmask: int) -> list[str]:
+    """
+    ビット列が表すテストスメルの名前を返す．
+    """
+    return [smell for column, smell in enumerate(SMELLS)
+            if bitmask >> column & 1]
+
+
+def count_smell_bitsets(bitsets: dict) -> dict:
+    """
+    ビット列からテストファイルごとのテストスメルの数を集計する．
+    PyNoseResultManager.count_test_smells_per_file と同じ形の辞書を返す．
+    :param bitsets: テストファイル名と [テストケース ID, ビット列] のリストの辞書．
+    """
+    result = {}
+    for file_name, test_cases in bitsets.items():
+        if not test_cases:
+            result[file_name] = {}
+            continue
+        counts = [0] * len(SMELLS)
+        for _, bitmask in test_cases:
+            while bitmask:
+                lowest = bitmask & -bitmask
+                counts[lowest.bit_length() - 1] += 1
+                bitmask ^= lowest
+        result[file_name] = dict(zip(SMELLS, counts))
+    return result
+
+
+def find_test_cases(bitsets: dict, smell: str) -> dict:
+    """
+    テストスメルを持つテストケースをテストファイルごとに返す．
+    :param bitsets: テストファイル名と [テストケース ID, ビット列] のリストの辞書．
+    :param smell: テストスメルの名前．
+    :return: テストファイル名とテストケース ID のリストの辞書．該当しないファイルは含まない．
+    """
+    bit = 1 << SMELL_COLUMNS[smell]
+    result = {}
+    for file_name, test_cases in bitsets.items():
+        found = [test_case_id for test_case_id, bitmask in test_cases
+                 if bitmask & bit]
+        if found:
+            result[file_name] = found
+    return result
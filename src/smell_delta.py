@@ -0,0 +1,179 @@
+"""
+圧縮した PyNose の結果を，連続するコミットの差分としてリポジトリごとにまとめるプログラム．
+連続するコミットの結果はほとんど同じなので，K コミットごとに全ファイルの結果を書き，
+間のコミットは直前のコミットから変わったファイルの結果だけを書く．
+他のステージはこの差分を読まず，compress_pynose_result.py の出力をそのまま使う．
+履歴全体を読む解析を新たに書く場合に，SmellDeltaStore.iter_history から結果を引く．
+"""
+import bisect
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from tqdm import tqdm
+
+import json_io
+from global_var import smell_delta_keyframe_interval
+from smell_matrix import (SMELLS, count_result_files, iter_compressed_results,
+                          to_row)
+
+
+def main():
+    """
+    compress_pynose_result.py の結果からリポジトリごとの差分を作る．
+    圧縮した結果の数が差分に載っているコミットの数と同じであれば作り直さない．
+    """
+    compressed_root = Path('../result/compress_pynose_result').resolve()
+    repo_names = sorted(dir_path.name for dir_path in compressed_root.iterdir()
+                        if dir_path.is_dir())
+    for repo_name in tqdm(repo_names):
+        store_dir = smell_delta_dir(repo_name)
+        result_cnt = count_result_files(compressed_root / repo_name)
+        if store_dir.exists() and len(SmellDeltaStore(store_dir)) == result_cnt:
+            continue
+        results = iter_compressed_results(compressed_root / repo_name)
+        build_smell_delta(results, store_dir, smell_delta_keyframe_interval)
+
+
+def smell_delta_dir(repo_name: str) -> Path:
+    """
+    リポジトリの差分を格納するディレクトリを返す．
+    """
+    this_file_name = Path(__file__).stem
+    return Path('../result/').resolve() / this_file_name / repo_name
+
+
+class SmellDeltaStore:
+    """
+    1 つのリポジトリの圧縮した結果を，キーフレームと差分の列として保持するクラス．
+
+    store_dir の構成：
+    history.jsonl  コミットの順番に 1 行ずつ並ぶ．各行は次のいずれかである．
+                   ["k", 順番, ハッシュ, {ファイル名: 行}]            キーフレーム
+                   ["d", 順番, ハッシュ, {ファイル名: 行}, [ファイル名]]  変わったファイルと消えたファイル
+                   行は SMELLS の順番に並べたテストスメルの数で，テストケースを持たないファイルは空のリスト．
+    keyframes.tsv  「順番<TAB>history.jsonl での位置」の行．キーフレームごとに 1 行．
+
+    任意のコミットは直前のキーフレームから読み進めるだけで組み立てられる．
+    """
+    history_file_name = 'history.jsonl'
+    keyframes_file_name = 'keyframes.tsv'
+
+    def __init__(self, store_dir: Path):
+        """
+        :param store_dir: 差分を格納しているディレクトリ．
+        """
+        self.store_dir = store_dir
+        self.history_path = store_dir / self.history_file_name
+        self._keyframe_ordinals = []
+        self._keyframe_offsets = []
+        with (store_dir / self.keyframes_file_name).open() as f:
+            for line in f:
+                ordinal, offset = line.rstrip('\n').split('\t')
+                self._keyframe_ordinals.append(int(ordinal))
+                self._keyframe_offsets.append(int(offset))
+
+    def __len__(self) -> int:
+        """
+        結果が存在するコミットの数．
+        """
+        with self.history_path.open('rb') as f:
+            return sum(1 for _ in f)
+
+    def materialize(self, ordinal: int) -> Optional[dict]:
+        """
+        コミットの結果を compress_pynose_result.py の出力と同じ形の辞書で返す．
+        コミットハッシュからは Repo.commit_index.get_ordinal で順番を引いてから呼ぶ．
+        :param ordinal: コミットの順番．
+        :return: 圧縮した結果．存在しない場合は None．
+        """
+        i = bisect.bisect_right(self._keyframe_ordinals, ordinal) - 1
+        if i < 0:
+            return None
+        for current, _, state in self._iter_from(self._keyframe_offsets[i]):
+            if current == ordinal:
+                return to_result(state)
+            if current > ordinal:
+                break
+        return None
+
+    def iter_history(self) -> Iterator[tuple[int, str, dict]]:
+        """
+        すべてのコミットの結果を先頭から 1 度だけ読み進めて返す．
+        :return: コミットの順番，コミットハッシュ，圧縮した結果の組．
+        """
+        for ordinal, commit_hash, state in self._iter_from(0):
+            yield ordinal, commit_hash, to_result(state)
+
+    def _iter_from(self, offset: int) -> Iterator[tuple[int, str, dict]]:
+        state = {}
+        with self.history_path.open('rb') as f:
+            f.seek(offset)
+            for line in f:
+                record = json_io.loads(line)
+                if record[0] == 'k':
+                    state = record[3]
+                else:
+                    state.update(record[3])
+                    for file_name in record[4]:
+                        del state[file_name]
+                yield record[1], record[2], state
+
+
+def build_smell_delta(results: Iterable[tuple[int, str, dict]],
+                      store_dir: Path,
+                      keyframe_interval: int) -> SmellDeltaStore:
+    """
+    圧縮した結果をコミットの順番に受け取って差分を作る．
+    作成中は別のディレクトリに書き出し，書き終えてから置き換える．
+    :param results: コミットの順番，コミットハッシュ，圧縮した結果の組．順番の昇順に並ぶ．
+    :param store_dir: 差分を格納するディレクトリ．
+    :param keyframe_interval: キーフレームを書く間隔．1 ならばすべてのコミットをキーフレームにする．
+    :raise ValueError: keyframe_interval が 1 未満．
+    """
+    if keyframe_interval < 1:
+        raise ValueError(
+            f'keyframe_interval must be at least 1: {keyframe_interval}')
+    tmp_dir = store_dir.with_name(store_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+
+    history_path = tmp_dir / SmellDeltaStore.history_file_name
+    keyframes_path = tmp_dir / SmellDeltaStore.keyframes_file_name
+    with history_path.open('wb') as history, \
+            keyframes_path.open('w') as keyframes:
+        previous = {}
+        for i, (ordinal, commit_hash, compressed_result) \
+                in enumerate(results):
+            state = {file_name: to_row(smells) if smells else []
+                     for file_name, smells in compressed_result.items()}
+            if i % keyframe_interval == 0:
+                keyframes.write(f'{ordinal}\t{history.tell()}\n')
+                record = ['k', ordinal, commit_hash, state]
+            else:
+                changed = {file_name: row for file_name, row in state.items()
+                           if previous.get(file_name) != row}
+                removed = [file_name for file_name in previous
+                           if file_name not in state]
+                record = ['d', ordinal, commit_hash, changed, removed]
+            history.write(json_io.dumps(record) + b'\n')
+            previous = state
+
+    if store_dir.exists():
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    return SmellDeltaStore(store_dir)
+
+
+def to_result(state: dict) -> dict:
+    """
+    ファイル名と行の辞書を compress_pynose_result.py の出力と同じ形に戻す．
+    """
+    return {file_name: dict(zip(SMELLS, row)) if row else {}
+            for file_name, row in state.items()}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+"""
+圧縮した PyNose の結果をリポジトリごとの列指向の行列にまとめるプログラム．
+コミットごとの json ファイルを開かずに，あるコミットのあるテストファイルの
+テストスメルの数を配列の添字だけで引けるようにする．
+"""
+import os
+import shutil
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
+from tqdm import tqdm
+
+import json_io
+
+# 列の順番．PyNose の Util.newAllDetectors と同じ順番にしている．
+SMELLS = (
+    'AssertionRoulette',
+    'ConditionalTestLogic',
+    'ConstructorInitialization',
+    'DefaultTest',
+    'DuplicateAssertion',
+    'EmptyTest',
+    'ExceptionHandling',
+    'GeneralFixture',
+    'IgnoredTest',
+    'MagicNumberTest',
+    'RedundantAssertion',
+    'RedundantPrint',
+    'SleepyTest',
+    'UnknownTest',
+    'ObscureInLineSetup',
+    'TestMaverick',
+    'LackCohesion',
+    'SuboptimalAssert',
+)
+SMELL_COLUMNS = {smell: column for column, smell in enumerate(SMELLS)}
+
+
+def main():
+    """
+    compress_pynose_result.py の結果からリポジトリごとの行列を作る．
+    圧縮した結果の数が行列に載っているコミットの数と同じであれば作り直さない．
+    """
+    compressed_root = Path('../result/compress_pynose_result').resolve()
+    repo_names = sorted(dir_path.name for dir_path in compressed_root.iterdir()
+                        if dir_path.is_dir())
+    for repo_name in tqdm(repo_names):
+        matrix_dir = smell_matrix_dir(repo_name)
+        result_cnt = count_result_files(compressed_root / repo_name)
+        if matrix_dir.exists() \
+                and len(SmellMatrix(matrix_dir)) == result_cnt:
+            continue
+        results = iter_compressed_results(compressed_root / repo_name)
+        build_smell_matrix(results, matrix_dir)
+
+
+def smell_matrix_dir(repo_name: str) -> Path:
+    """
+    リポジトリの行列を格納するディレクトリを返す．
+    """
+    this_file_name = Path(__file__).stem
+    return Path('../result/').resolve() / this_file_name / repo_name
+
+
+def count_result_files(compressed_dir: Path) -> int:
+    """
+    圧縮した結果のファイルの数を数える．
+    """
+    with os.scandir(compressed_dir) as entries:
+        return sum(1 for entry in entries if entry.name.endswith('.json'))
+
+
+class SmellMatrix:
+    """
+    1 つのリポジトリの圧縮した結果を CSR 形式の行列として保持するクラス．
+    各行は 1 つのコミットの 1 つのテストファイルであり，列は SMELLS の順番である．
+
+    matrix_dir の構成：
+    file_names.npy     テストファイル名の辞書．行はこの添字でファイルを表す．
+    commit_hashes.npy  コミットの順番 - 1 を添字とするコミットハッシュ．結果がなければ空文字列．
+    commit_ptr.npy     順番 o のコミットの行は commit_ptr[o - 1]:commit_ptr[o] である．
+    file_ids.npy       各行のテストファイル名の添字．コミットの中では昇順に並ぶ．
+    counts.npy         各行のテストスメルの数．
+    has_cases.npy      各行のファイルがテストケースを持つか．持たないファイルは空の辞書に戻す．
+
+    配列はメモリマップで開くので，読み込むのは参照した部分だけである．
+    """
+    def __init__(self, matrix_dir: Path):
+        """
+        :param matrix_dir: 行列を格納しているディレクトリ．
+        """
+        self.matrix_dir = matrix_dir
+        self.file_names = self._load('file_names')
+        self.commit_hashes = self._load('commit_hashes')
+        self.commit_ptr = self._load('commit_ptr')
+        self.file_ids = self._load('file_ids')
+        self.counts = self._load('counts')
+        self.has_cases = self._load('has_cases')
+        self._file_index = {name: file_id for file_id, name
+                            in enumerate(self.file_names.tolist())}
+        self._ordinals = {commit_hash: ordinal for ordinal, commit_hash
+                          in enumerate(self.commit_hashes.tolist(), 1)
+                          if commit_hash}
+
+    def __len__(self) -> int:
+        """
+        結果が存在するコミットの数．
+        """
+        return len(self._ordinals)
+
+    def __contains__(self, commit_hash: str) -> bool:
+        return commit_hash in self._ordinals
+
+    def get_ordinal(self, commit_hash: str) -> Optional[int]:
+        """
+        コミットハッシュからコミットの順番を引く．結果がなければ None．
+        """
+        return self._ordinals.get(commit_hash)
+
+    def get_latest_ordinal(self) -> Optional[int]:
+        """
+        結果が存在する最後のコミットの順番を返す．
+        """
+        present = np.flatnonzero(self.commit_hashes != '')
+        if not len(present):
+            return None
+        return int(present[-1]) + 1
+
+    def get_commit(self, commit: Union[int, str]) -> dict:
+        """
+        コミットの結果を compress_pynose_result.py の出力と同じ形の辞書で返す．
+        :param commit: コミットの順番もしくはコミットハッシュ．
+        """
+        start, end = self._rows(commit)
+        return {self.file_names[file_id]: self._row_to_dict(row)
+                for row, file_id in enumerate(self.file_ids[start:end], start)}
+
+    def get_file(self, commit: Union[int, str], file_name: str) -> dict:
+        """
+        あるコミットのあるテストファイルのテストスメルの数を返す．
+        :param commit: コミットの順番もしくはコミットハッシュ．
+        :param file_name: テストファイル名．
+        :raise KeyError: コミットの結果かテストファイルが存在しない．
+        """
+        return self._row_to_dict(self._find_row(commit, file_name))
+
+    def sum_files(self, commit: Union[int, str], file_names: list[str]) -> dict:
+        """
+        あるコミットの複数のテストファイルのテストスメルの数を合計する．
+        :param commit: コミットの順番もしくはコミットハッシュ．
+        :param file_names: テストファイル名のリスト．
+        :raise KeyError: コミットの結果かいずれかのテストファイルが存在しない．
+        """
+        rows = [self._find_row(commit, file_name) for file_name in file_names]
+        rows = [row for row in rows if self.has_cases[row]]
+        if not rows:
+            return {}
+        totals = self.counts[rows].sum(axis=0)
+        return dict(zip(SMELLS, totals.tolist()))
+
+    def get_history(self, file_name: str) -> np.ndarray:
+        """
+        テストファイルのテストスメルの数の履歴を返す．
+        :param file_name: テストファイル名．
+        :return: (コミットの数, len(SMELLS)) の配列．行 o - 1 が順番 o のコミットである．
+        ファイルが存在しないコミットは 0 である．
+        """
+        history = np.zeros((len(self.commit_hashes), len(SMELLS)),
+                           dtype=self.counts.dtype)
+        file_id = self._file_index.get(file_name)
+        if file_id is None:
+            return history
+        rows = np.flatnonzero(self.file_ids == file_id)
+        commits = np.searchsorted(self.commit_ptr, rows, side='right') - 1
+        history[commits] = self.counts[rows]
+        return history
+
+    def get_totals(self) -> np.ndarray:
+        """
+        コミットごとに全テストファイルのテストスメルの数を合計する．
+        :return: (コミットの数, len(SMELLS)) の配列．
+        """
+        totals = np.zeros((len(self.commit_hashes), len(SMELLS)),
+                          dtype=np.int64)
+        row_cnts = np.diff(self.commit_ptr)
+        present = np.flatnonzero(row_cnts)
+        if len(present):
+            totals[present] = np.add.reduceat(
+                self.counts, self.commit_ptr[present], axis=0)
+        return totals
+
+    def _load(self, name: str) -> np.ndarray:
+        return np.load(self.matrix_dir / f'{name}.npy', mmap_mode='r')
+
+    def _rows(self, commit: Union[int, str]) -> tuple[int, int]:
+        ordinal = commit if isinstance(commit, int) \
+            else self._ordinals.get(commit)
+        if ordinal is None or not 1 <= ordinal <= len(self.commit_hashes) \
+                or not self.commit_hashes[ordinal - 1]:
+            raise KeyError(commit)
+        return int(self.commit_ptr[ordinal - 1]), int(self.commit_ptr[ordinal])
+
+    def _find_row(self, commit: Union[int, str], file_name: str) -> int:
+        start, end = self._rows(commit)
+        file_id = self._file_index.get(file_name)
+        if file_id is None:
+            raise KeyError(file_name)
+        row = start + int(np.searchsorted(self.file_ids[start:end], file_id))
+        if row == end or self.file_ids[row] != file_id:
+            raise KeyError(file_name)
+        return row
+
+    def _row_to_dict(self, row: int) -> dict:
+        if not self.has_cases[row]:
+            return {}
+        return dict(zip(SMELLS, self.counts[row].tolist()))
+
+
+def iter_compressed_results(compressed_dir: Path) \
+        -> Iterator[tuple[int, str, dict]]:
+    """
+    圧縮した結果のファイルをコミットの順番に読み込む．
+    :param compressed_dir: 圧縮した結果を格納しているディレクトリ．
+    :return: コミットの順番，コミットハッシュ，圧縮した結果の組．
+    """
+    paths = {}
+    with os.scandir(compressed_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            _, ordinal, commit_hash = entry.name[:-len('.json')].rsplit('_', 2)
+            paths[int(ordinal)] = (commit_hash, Path(entry.path))
+
+    for ordinal in sorted(paths):
+        commit_hash, path = paths[ordinal]
+        yield ordinal, commit_hash, json_io.read(path)
+
+
+def build_smell_matrix(results: Iterable[tuple[int, str, dict]],
+                       matrix_dir: Path) -> SmellMatrix:
+    """
+    圧縮した結果をコミットの順番に受け取って行列を作る．
+    作成中は別のディレクトリに書き出し，書き終えてから置き換える．
+    :param results: コミットの順番，コミットハッシュ，圧縮した結果の組．順番の昇順に並ぶ．
+    iter_compressed_results か SmellDeltaStore.iter_history を与える．
+    :param matrix_dir: 行列を格納するディレクトリ．
+    """
+    commit_hashes = []
+    commit_ptr = [0]
+    file_index = {}
+    file_ids = []
+    counts = []
+    has_cases = []
+    for ordinal, commit_hash, compressed_result in results:
+        while len(commit_hashes) < ordinal - 1:
+            commit_hashes.append('')
+            commit_ptr.append(len(file_ids))
+        commit_hashes.append(commit_hash)
+        rows = sorted((file_index.setdefault(name, len(file_index)), smells)
+                      for name, smells in compressed_result.items())
+        for file_id, smells in rows:
+            file_ids.append(file_id)
+            counts.append(to_row(smells))
+            has_cases.append(bool(smells))
+        commit_ptr.append(len(file_ids))
+
+    tmp_dir = matrix_dir.with_name(matrix_dir.name + '.tmp')
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)
+    tmp_dir.mkdir(parents=True)
+    np.save(tmp_dir / 'file_names.npy',
+            np.array(list(file_index), dtype=np.str_))
+    np.save(tmp_dir / 'commit_hashes.npy',
+            np.array(commit_hashes, dtype='U40'))
+    np.save(tmp_dir / 'commit_ptr.npy', np.array(commit_ptr, dtype=np.int64))
+    np.save(tmp_dir / 'file_ids.npy', np.array(file_ids, dtype=np.int32))
+    np.save(tmp_dir / 'counts.npy',
+            np.array(counts, dtype=np.int32).reshape(-1, len(SMELLS)))
+    np.save(tmp_dir / 'has_cases.npy', np.array(has_cases, dtype=np.bool_))
+    if matrix_dir.exists():
+        shutil.rmtree(matrix_dir)
+    os.replace(tmp_dir, matrix_dir)
+    return SmellMatrix(matrix_dir)
+
+
+def to_row(smells: dict) -> list[int]:
+    """
+    テストスメルの数の辞書を SMELLS の順番の行にする．
+    SMELLS にないテストスメルは smell_bitset.encode と同じく読み飛ばし，名前ごとに 1 度だけ警告する．
+    """
+    row = [0] * len(SMELLS)
+    for smell, count in smells.items():
+        column = SMELL_COLUMNS.get(smell)
+        if column is None:
+            warn_unknown_smell(smell)
+            continue
+        row[column] = count
+    return row
+
+
+_warned_smells = set()
+
+
+def warn_unknown_smell(name: str) -> None:
+    """
+    SMELLS にないテストスメルを，プロセスごとに名前ごとに 1 度だけ警告する．
+    """
+    if name in _warned_smells:
+        return
+    _warned_smells.add(name)
+    print(f'unknown smell is skipped: {name}')
+
+
+@lru_cache(maxsize=1)
+def load_smell_matrix(repo_name: str) -> Optional[SmellMatrix]:
+    """
+    リポジトリの行列を開く．同じリポジトリを続けて引く場合は開き直さない．
+    main と同じく，圧縮した結果の数が行列に載っているコミットの数と違えば古いとみなす．
+    :param repo_name: リポジトリ名．
+    :return: 行列．まだ作られていないか古い場合は None．
+    """
+    matrix_dir = smell_matrix_dir(repo_name)
+    if not matrix_dir.exists():
+        return None
+    smell_matrix = SmellMatrix(matrix_dir)
+    compressed_dir = Path('../result/compress_pynose_result').resolve() \
+        / repo_name
+    if len(smell_matrix) != count_result_files(compressed_dir):
+        print(f'smell matrix of {repo_name} is stale')
+        return None
+    return smell_matrix
+
+
+if __name__ == '__main__':
+    main()